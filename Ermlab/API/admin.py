@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Car, Reservation
+from .models import Car, Reservation, RecurringReservation, ArchivedReservation
 
 admin.site.register(Car)
 admin.site.register(Reservation)
+admin.site.register(RecurringReservation)
+admin.site.register(ArchivedReservation)
@@ -0,0 +1,169 @@
+from django.conf import settings
+from django.db.models import F, Q, Value, Sum, Count, DateField, DateTimeField, DurationField, ExpressionWrapper, \
+    FilteredRelation
+from django.db.models.functions import Least, Greatest, TruncWeek
+from datetime import datetime, time, timedelta, timezone
+from collections import defaultdict
+from .models import Car, ReservationHistory, DailyOccupancy, BATCH_SIZE
+from .dates import to_datetime
+
+# Query parameter `group_by` mapped to field of the car
+GROUPS = {'car': 'id', 'brand': 'brand'}
+BUCKETS = ('day', 'week')
+# Maximal number of buckets summed from reservations in one query, longer reports need the rollup
+MAX_BUCKETS = 400
+
+
+def is_rollup_enabled():
+    return getattr(settings, 'OCCUPANCY_ROLLUP_ENABLED', False)
+
+
+def get_start_of_day(value):
+    """
+    :return: Returns midnight of the day of given datetime, days are counted in UTC
+    """
+
+    return datetime.combine(value.astimezone(timezone.utc).date(), time(), tzinfo=timezone.utc)
+
+
+def get_overlap(period_from, period_to, prefix=''):
+    """
+    Builds expression of time which reservation spends inside of given period, reservation has to overlap it
+    :param prefix: path to reservation fields, e.g. 'booking__'
+    """
+
+    return ExpressionWrapper(
+        Least(F(f'{prefix}date_to'), Value(period_to, output_field=DateTimeField())) -
+        Greatest(F(f'{prefix}date_from'), Value(period_from, output_field=DateTimeField())),
+        output_field=DurationField())
+
+
+def get_buckets(period_from, period_to, bucket=None):
+    """
+    Splits period into days or weeks starting on Monday, the first and the last one are clipped to the period
+    :param bucket: 'day', 'week' or None for whole period
+    :return: Returns list of tuples (label, start, end), label is date of the first day of bucket
+    """
+
+    if bucket is None:
+        return [(None, period_from, period_to)]
+
+    start = get_start_of_day(period_from)
+    if bucket == 'week':
+        start -= timedelta(days=start.weekday())
+    step = timedelta(days=7 if bucket == 'week' else 1)
+    buckets = []
+    while start < period_to:
+        buckets.append((start.date(), max(start, period_from), min(start + step, period_to)))
+        start += step
+    return buckets
+
+
+def get_booked_from_reservations(period_from, period_to, group_by, buckets):
+    """
+    Sums clipped durations of current and archived reservations for every group and bucket with one query
+    :return: Returns tuple of dicts: number of cars of every group and booked time of every (group, bucket index)
+    """
+
+    key = GROUPS[group_by]
+    # Only reservations overlapping the period are joined, cars without them are kept by outer join
+    cars = Car.objects.annotate(booking=FilteredRelation('reservationhistory', condition=Q(
+        reservationhistory__date_from__lt=period_to, reservationhistory__date_to__gt=period_from)))
+    sums = {f'bucket_{index}': Sum(get_overlap(start, end, 'booking__'),
+                                   filter=Q(booking__date_from__lt=end, booking__date_to__gt=start))
+            for index, (_, start, end) in enumerate(buckets)}
+
+    cars_of_group = {}
+    booked = {}
+    for row in cars.values(key).annotate(cars=Count('id', distinct=True), **sums).order_by(key):
+        cars_of_group[row[key]] = row['cars']
+        for index in range(len(buckets)):
+            booked[row[key], index] = row[f'bucket_{index}']
+    return cars_of_group, booked
+
+
+def get_booked_from_rollup(period_from, period_to, group_by, buckets, bucket):
+    """
+    Sums daily occupancy rollup for every group and bucket, period has to start and end at midnight
+    :return: Returns the same as get_booked_from_reservations
+    """
+
+    key = GROUPS[group_by]
+    cars_of_group = dict(Car.objects.values_list(key).annotate(cars=Count('id')).order_by(key))
+
+    occupancy = DailyOccupancy.objects.filter(day__gte=period_from.date(), day__lt=period_to.date())
+    group_field = 'car' if group_by == 'car' else f'car__{key}'
+    if bucket == 'week':
+        occupancy = occupancy.annotate(bucket=TruncWeek('day'))
+    elif bucket == 'day':
+        occupancy = occupancy.annotate(bucket=F('day'))
+    else:
+        occupancy = occupancy.annotate(bucket=Value(None, output_field=DateField()))
+    index_of_label = {label: index for index, (label, _, _) in enumerate(buckets)}
+
+    booked = {}
+    for group, label, duration in occupancy.values_list(group_field, 'bucket').annotate(
+            booked=Sum('booked')).order_by():
+        booked[group, index_of_label[label]] = duration
+    return cars_of_group, booked
+
+
+def get_utilization(period_from, period_to, group_by='car', bucket=None):
+    """
+    Computes booked and available hours of cars grouped by car or brand, optionally split into days or weeks.
+    Uses the daily occupancy rollup if it's enabled and the period starts and ends at midnight
+    :param group_by: 'car' or 'brand'
+    :param bucket: 'day', 'week' or None for whole period
+    :return: Returns list of dicts, one for every group and bucket
+    :raises ValueError: if there are too many buckets to sum them from reservations
+    """
+
+    buckets = get_buckets(period_from, period_to, bucket)
+    if is_rollup_enabled() and get_start_of_day(period_from) == period_from and \
+            get_start_of_day(period_to) == period_to:
+        cars_of_group, booked = get_booked_from_rollup(period_from, period_to, group_by, buckets, bucket)
+    elif len(buckets) > MAX_BUCKETS:
+        raise ValueError(f"Period can't be split into more than {MAX_BUCKETS} buckets")
+    else:
+        cars_of_group, booked = get_booked_from_reservations(period_from, period_to, group_by, buckets)
+
+    results = []
+    for group, cars in cars_of_group.items():
+        for index, (label, start, end) in enumerate(buckets):
+            booked_hours = (booked.get((group, index)) or timedelta()) / timedelta(hours=1)
+            available_hours = (end - start) * cars / timedelta(hours=1)
+            result = {group_by: group}
+            if label is not None:
+                result['bucket'] = label
+            result.update(booked_hours=booked_hours, available_hours=available_hours,
+                          utilization=booked_hours / available_hours if available_hours else 0)
+            results.append(result)
+    return results
+
+
+def refresh_occupancy(car_id, period_from, period_to):
+    """
+    Recomputes daily occupancy rollup of the car for every day touched by given period. Archived reservations
+    are included, so archiving doesn't change utilization of past days
+    :param car_id: primary key of the car
+    :param period_from: start of changed period, datetime or string in ISO 8601 format
+    :param period_to: end of changed period, datetime or string in ISO 8601 format
+    """
+
+    period_from, period_to = sorted((to_datetime(period_from), to_datetime(period_to)))
+    day_start = get_start_of_day(period_from)
+    day_end = get_start_of_day(period_to) + timedelta(days=1)
+
+    booked = defaultdict(timedelta)
+    periods = ReservationHistory.objects.filter(booked_car=car_id, date_from__lt=day_end, date_to__gt=day_start)
+    for date_from, date_to in periods.values_list('date_from', 'date_to'):
+        start = max(date_from, day_start)
+        end = min(date_to, day_end)
+        while start < end:
+            next_day = get_start_of_day(start) + timedelta(days=1)
+            booked[start.date()] += min(end, next_day) - start
+            start = next_day
+
+    DailyOccupancy.objects.filter(car=car_id, day__gte=day_start.date(), day__lt=day_end.date()).delete()
+    DailyOccupancy.objects.bulk_create([DailyOccupancy(car_id=car_id, day=day, booked=duration)
+                                        for day, duration in booked.items()], batch_size=BATCH_SIZE)
@@ -0,0 +1,9 @@
+from django.urls import path
+from . import urls
+from .async_views import ASYNC_VIEWS
+
+# The same routes as in urls.py, views of cars and reservations are served by async views
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS.get(pattern.callback.cls, pattern.callback))
+    for pattern in urls.urlpatterns
+]
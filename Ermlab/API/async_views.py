@@ -0,0 +1,75 @@
+"""
+Handlers of ASGI application for car and reservation views. They aren't async native: Django 3.1 has no async
+ORM (aget and aexists came in 4.1) and rest framework 3.12 has no async views, so every request still runs
+the sync view in a thread. What they change is the pool: Django runs sync views one by one in a single thread,
+these handlers run them in a dedicated pool of ASYNC_VIEW_THREADS threads, every thread with own database
+connection. It's the ceiling of concurrently handled requests, others wait in the queue of the pool,
+while the event loop keeps serving streams and accepting connections
+"""
+from django.conf import settings
+from django.db import close_old_connections
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial, wraps
+from threading import Lock
+from . import views
+import asyncio
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor():
+    """
+    :return: Returns pool of threads for views, created on the first request
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_VIEW_THREADS', 20),
+                                           thread_name_prefix='async-view')
+        return _executor
+
+
+def async_view(view_class):
+    """
+    Serves rest framework view under ASGI from pool of threads, without blocking the event loop.
+    Whole request, with its transaction, is handled by one thread
+    """
+
+    view = view_class.as_view()
+
+    def handle(request, *args, **kwargs):
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    @wraps(view)
+    async def async_handler(request, *args, **kwargs):
+        # Context is copied, so metrics and routing of the request are seen by the thread
+        call = partial(copy_context().run, handle, request, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), call)
+
+    # Like rest framework views, csrf_exempt decorator isn't async in this version of Django
+    async_handler.csrf_exempt = True
+    return async_handler
+
+
+CarList = async_view(views.CarList)
+AvailableCarList = async_view(views.AvailableCarList)
+CarDetail = async_view(views.CarDetail)
+ReservationList = async_view(views.ReservationList)
+ReservationDetails = async_view(views.ReservationDetails)
+
+ASYNC_VIEWS = {
+    views.CarList: CarList,
+    views.AvailableCarList: AvailableCarList,
+    views.CarDetail: CarDetail,
+    views.ReservationList: ReservationList,
+    views.ReservationDetails: ReservationDetails,
+}
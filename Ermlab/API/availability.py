@@ -0,0 +1,114 @@
+from collections import defaultdict
+from itertools import accumulate
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from .models import Car, Reservation, BATCH_SIZE
+
+# Maximal size of matrix checked in one request
+MAX_CARS = 1000
+MAX_WINDOWS = 100
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@lru_cache(maxsize=None)
+def get_numpy():
+    """
+    Imports numpy on the first check, so it doesn't slow down start of processes which never use it
+    :return: Returns numpy module or None if it isn't installed
+    """
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def to_microseconds(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def get_free_with_numpy(starts, latest_ends, window_froms, window_tos):
+    """
+    Checks all windows of one car at once with numpy.searchsorted
+    :param starts: sorted starts of reservations of the car
+    :param latest_ends: the latest end of reservations up to every position of starts
+    :return: Returns list of booleans, True for windows which don't collide with any reservation
+    """
+
+    if not starts:
+        return [True] * len(window_froms)
+    numpy = get_numpy()
+    # Reservations which start before window ends collide if any of them ends after window starts
+    positions = numpy.searchsorted(numpy.array(starts), window_tos, side='left')
+    previous_ends = numpy.array(latest_ends)[numpy.maximum(positions - 1, 0)]
+    return ((positions == 0) | (previous_ends <= window_froms)).tolist()
+
+
+def get_free_with_bisect(starts, latest_ends, window_froms, window_tos):
+    """
+    The same as get_free_with_numpy, used when numpy isn't installed
+    """
+
+    free = []
+    for window_from, window_to in zip(window_froms, window_tos):
+        position = bisect_left(starts, window_to)
+        free.append(not position or latest_ends[position - 1] <= window_from)
+    return free
+
+
+def get_matrix(car_ids, windows):
+    """
+    Checks if every car can be booked in every window by rules of Reservation.is_period_valid.
+    Reservations of all cars overlapping union of windows are fetched with one query per BATCH_SIZE cars
+    and every car is checked with one sweep over its sorted reservations
+    :param car_ids: list of ids of cars
+    :param windows: list of tuples (date_from, date_to)
+    :return: Returns tuple of matrix with row of booleans for every car and column for every window,
+    and list of ids of cars which don't exist
+    """
+
+    examinations = {}
+    for start in range(0, len(car_ids), BATCH_SIZE):
+        examinations.update(Car.objects.filter(pk__in=car_ids[start:start + BATCH_SIZE])
+                            .values_list('pk', 'date_of_next_technical_examination'))
+
+    found = list(examinations)
+    periods = defaultdict(lambda: ([], []))
+    if found and windows:
+        period_from = min(date_from for date_from, _ in windows)
+        period_to = max(date_to for _, date_to in windows)
+        for start in range(0, len(found), BATCH_SIZE):
+            reservations = Reservation.objects.filter(booked_car__in=found[start:start + BATCH_SIZE],
+                                                      date_from__lt=period_to, date_to__gt=period_from)
+            for car_id, date_from, date_to in reservations.order_by('booked_car', 'date_from').values_list(
+                    'booked_car', 'date_from', 'date_to'):
+                periods[car_id][0].append(to_microseconds(date_from))
+                periods[car_id][1].append(to_microseconds(date_to))
+
+    window_froms = [to_microseconds(date_from) for date_from, _ in windows]
+    window_tos = [to_microseconds(date_to) for _, date_to in windows]
+    # Day of the end is taken in offset of the window, like by is_period_valid
+    window_days = [date_to.date() for _, date_to in windows]
+    numpy = get_numpy()
+    if numpy is not None:
+        get_free = get_free_with_numpy
+        window_froms, window_tos = numpy.array(window_froms), numpy.array(window_tos)
+    else:
+        get_free = get_free_with_bisect
+    ordered = [date_from <= date_to for date_from, date_to in windows]
+
+    matrix = []
+    for car_id in car_ids:
+        if car_id not in examinations:
+            matrix.append([False] * len(windows))
+            continue
+        starts, ends = periods[car_id]
+        free = get_free(starts, list(accumulate(ends, max)), window_froms, window_tos)
+        examination = examinations[car_id]
+        matrix.append([is_free and is_ordered and day <= examination
+                       for is_free, is_ordered, day in zip(free, ordered, window_days)])
+
+    return matrix, sorted(set(car_ids) - set(found))
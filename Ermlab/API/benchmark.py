@@ -0,0 +1,274 @@
+"""
+Helpers of benchmark commands: seeding of data, timing and load drivers which call WSGI and ASGI applications
+in process or send requests to local HTTP server
+"""
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test.utils import override_settings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from socketserver import ThreadingMixIn
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from .models import Car, Reservation, BATCH_SIZE
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+REGISTRATION_PREFIX = 'BENCH'
+
+
+def seed(cars, reservations_per_car, seed_value=0):
+    """
+    Creates cars with registration numbers starting with REGISTRATION_PREFIX and their reservations.
+    Reservations of a car don't collide, they start from 2021 and last from one hour to three days
+    :return: Returns list of ids of created cars
+    """
+
+    rand = random.Random(seed_value)
+    brands = ['Opel', 'Skoda', 'Toyota', 'BMW', 'Fiat']
+    Car.objects.bulk_create(
+        (Car(brand=rand.choice(brands), model='Benchmark', registration_number=f'{REGISTRATION_PREFIX}{number}',
+             date_of_next_technical_examination=date(2030, 1, 1) - timedelta(days=rand.randrange(0, 3000)))
+         for number in range(cars)), batch_size=BATCH_SIZE)
+    car_ids = list(Car.objects.filter(registration_number__startswith=REGISTRATION_PREFIX).order_by('id')
+                   .values_list('id', flat=True))
+
+    reservations = []
+    for car_id in car_ids:
+        date_to = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        for _ in range(reservations_per_car):
+            date_from = date_to + timedelta(hours=rand.randrange(0, 48))
+            date_to = date_from + timedelta(hours=rand.randrange(1, 72))
+            reservations.append(Reservation(booking_person='Benchmark', date_from=date_from, date_to=date_to,
+                                            booked_car_id=car_id))
+        if len(reservations) >= 10 * BATCH_SIZE:
+            Reservation.objects.bulk_create(reservations, batch_size=BATCH_SIZE)
+            reservations = []
+    Reservation.objects.bulk_create(reservations, batch_size=BATCH_SIZE)
+    return car_ids
+
+
+def clean():
+    """
+    Removes data created by seed
+    """
+
+    Reservation.objects.filter(booked_car__registration_number__startswith=REGISTRATION_PREFIX).delete()
+    Car.objects.filter(registration_number__startswith=REGISTRATION_PREFIX).delete()
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Runs the block in a new database created like the one of tests, with its own cache and without replicas,
+    so seeded data, its change log and cached responses never reach the configured database. The database is
+    destroyed at the end
+    """
+
+    name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    test_name = test_settings.get('NAME')
+    with TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            test_settings['NAME'] = str(Path(directory) / 'benchmark.sqlite3')
+        else:
+            test_settings['NAME'] = f'benchmark_{name}'
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                      'LOCATION': 'benchmark'}}
+                with override_settings(CACHES=caches, REPLICA_DATABASES=[]):
+                    yield
+            finally:
+                connection.creation.destroy_test_db(name, verbosity=0)
+        finally:
+            test_settings['NAME'] = test_name
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies, elapsed):
+    """
+    :param latencies: latencies of requests in seconds
+    :param elapsed: time of whole run in seconds
+    :return: Returns dict with number of requests, throughput and latency percentiles in milliseconds
+    """
+
+    return {
+        'requests': len(latencies),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_wsgi(urls, concurrency):
+    """
+    Sends GET requests for urls to WSGI application from `concurrency` threads
+    :return: Returns tuple of latencies of requests and time of whole run
+    """
+
+    application = WSGIHandler()
+
+    def request(url):
+        parts = urlsplit(url)
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': parts.path, 'QUERY_STRING': parts.query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+            'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+        }
+        started = time.perf_counter()
+        response = application(environ, lambda status, headers: None)
+        b''.join(response)
+        response.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(request, urls))
+    return latencies, time.perf_counter() - started
+
+
+def run_asgi(urls, concurrency):
+    """
+    Sends GET requests for urls to ASGI application, at most `concurrency` of them at once
+    :return: Returns tuple of latencies of requests and time of whole run
+    """
+
+    application = ASGIHandler()
+
+    async def request(url, semaphore):
+        parts = urlsplit(url)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': parts.path, 'raw_path': parts.path.encode(), 'query_string': parts.query.encode(),
+            'root_path': '', 'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        async with semaphore:
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            return time.perf_counter() - started
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(request(url, semaphore) for url in urls))
+
+    started = time.perf_counter()
+    latencies = asyncio.run(run())
+    return latencies, time.perf_counter() - started
+
+
+def measure(function, repeat):
+    """
+    Calls function `repeat` times
+    :return: Returns list of times of calls in seconds
+    """
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def local_server():
+    """
+    Serves WSGI application on free local port in background thread
+    :return: Yields address of the server, e.g. http://127.0.0.1:8123
+    """
+
+    server = make_server('127.0.0.1', 0, WSGIHandler(), server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    server.request_queue_size = 128
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_http(address, urls, concurrency):
+    """
+    Sends GET requests for urls to HTTP server from `concurrency` threads
+    :return: Returns tuple of latencies of requests, time of whole run and number of failed requests
+    """
+
+    errors = []
+
+    def request(url):
+        started = time.perf_counter()
+        try:
+            with urlopen(address + url) as response:
+                response.read()
+        except (HTTPError, URLError) as error:
+            errors.append(error)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(request, urls))
+    return latencies, time.perf_counter() - started, len(errors)
+
+
+def run_startup(settings_module, database_name=None):
+    """
+    Starts new process with API.startup probe, which boots Django with given settings and serves /api/cars
+    :param database_name: name of database used by the probe instead of DATABASE_NAME of environment
+    :return: Returns dict printed by the probe with time from start of the process to the first response
+    :raises RuntimeError: if the probe fails
+    """
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    env.pop('DJANGO_ROOT_URLCONF', None)
+    if database_name is not None:
+        env['DATABASE_NAME'] = str(database_name)
+
+    started = time.monotonic()
+    process = subprocess.run([sys.executable, '-m', 'API.startup'], cwd=Path(__file__).resolve().parent.parent,
+                             env=env, capture_output=True, text=True)
+    if process.returncode:
+        raise RuntimeError(f"Startup probe of {settings_module} failed: {process.stderr.strip()}")
+
+    result = json.loads(process.stdout.splitlines()[-1])
+    result['first_response_ms'] = round((result.pop('responded_at') - started) * 1000, 1)
+    return result
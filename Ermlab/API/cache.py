@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from .routers import replica_database
+from . import metrics
+from functools import wraps
+from hashlib import md5
+import json
+import time
+import zlib
+
+# Stored instead of response while the first request with idempotency key is handled
+IN_PROGRESS = b''
+
+
+def bump_versions(*scopes):
+    """
+    Marks data of given scopes as changed, so responses cached for older versions aren't used anymore.
+    Inside transaction versions are bumped again after commit, because requests reading data before commit
+    cache old data for the first new versions
+    :param scopes: names of changed data, e.g. 'car:1'
+    """
+
+    def bump():
+        now = time.time()
+        cache.set_many({f'version:{scope}': now for scope in scopes}, None)
+
+    if transaction.get_connection().in_atomic_block:
+        bump()
+    transaction.on_commit(bump)
+
+
+def get_versions(*scopes):
+    """
+    :param scopes: names of data, e.g. 'car:1'
+    :return: Returns list of versions of given scopes, version is time of the last change
+    """
+
+    keys = [f'version:{scope}' for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        # Unknown scopes get version now, nobody could cache them before
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, missing.get(key)) for key in keys]
+
+
+def cached_response(*scopes):
+    """
+    Caches data of successful GET responses until data of any of scopes changes.
+    Responses get ETag and Last-Modified headers, so clients may ask with If-None-Match or If-Modified-Since
+    and get 304 without body. Last-Modified is sent only after the second of the last change has ended.
+    Responses read from a replica are cached apart from ones read from the primary, so clients reading
+    their own writes from the primary never get data of a lagging replica
+    :param scopes: names of data the response depends on, formatted with arguments of the view,
+    e.g. 'reservations:{pk}'
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            versions = get_versions(*(scope.format(**kwargs) for scope in scopes))
+            last_modified = max(versions)
+            # Last-Modified has precision of seconds, until the second of the last change ends another change
+            # may get the same date. Only then the date is sent and If-Modified-Since is trusted, till then
+            # ETag is the only validator
+            settled = int(last_modified) < int(time.time())
+            database = replica_database.get() or 'default'
+            key = md5(f'{request.get_full_path()}:{versions}:{database}'.encode()).hexdigest()
+            etag = f'"{key}"'
+
+            if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+            if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            if (if_none_match is not None and etag in if_none_match.split(', ')) or \
+                    (if_none_match is None and if_modified_since is not None and settled and
+                     if_modified_since >= int(last_modified)):
+                metrics.response_cache.inc(result='not_modified')
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                data = cache.get(f'response:{key}')
+                metrics.response_cache.inc(result='miss' if data is None else 'hit')
+                if data is None:
+                    response = method(view, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    cache.set(f'response:{key}', response.data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+                else:
+                    response = Response(data)
+
+            response['ETag'] = etag
+            if settled:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def idempotent(method):
+    """
+    Makes write handler safe to retry. The first response to request with `Idempotency-Key` header is stored
+    for IDEMPOTENCY_KEY_TIMEOUT seconds as compressed JSON and replayed for retries with the same key,
+    without validation and writes. Retries with the same key and different body get 422,
+    retries sent while the first request is handled get 409. The key is locked for the first request only
+    for IDEMPOTENCY_LOCK_TIMEOUT seconds, so the key of a worker killed in the middle can be retried soon.
+    Server errors aren't stored
+    """
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not idempotency_key:
+            return method(view, request, *args, **kwargs)
+
+        key = 'idempotency:' + md5(f'{request.method}:{request.path}:{idempotency_key}'.encode()).hexdigest()
+        fingerprint = md5(json.dumps(request.data, cls=JSONEncoder, sort_keys=True).encode()).hexdigest()
+        timeout = getattr(settings, 'IDEMPOTENCY_KEY_TIMEOUT', 86400)
+        lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+
+        if not cache.add(key, IN_PROGRESS, lock_timeout):
+            stored = cache.get(key)
+            if stored is not None and stored != IN_PROGRESS:
+                stored_fingerprint, status_code, body = stored
+                if stored_fingerprint != fingerprint:
+                    metrics.idempotent_requests.inc(result='mismatch')
+                    return Response("Idempotency-Key was already used with different request",
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                metrics.idempotent_requests.inc(result='replayed')
+                response = Response(json.loads(zlib.decompress(body)), status=status_code)
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            # Stored response or lock has just expired, otherwise another request is handled now
+            if stored == IN_PROGRESS or not cache.add(key, IN_PROGRESS, lock_timeout):
+                metrics.idempotent_requests.inc(result='conflict')
+                return Response("Request with this Idempotency-Key is still processed",
+                                status=status.HTTP_409_CONFLICT)
+
+        metrics.idempotent_requests.inc(result='new')
+        try:
+            response = method(view, request, *args, **kwargs)
+        except Exception:
+            cache.delete(key)
+            raise
+        if response.status_code >= 500:
+            cache.delete(key)
+        else:
+            body = zlib.compress(json.dumps(response.data, cls=JSONEncoder).encode())
+            cache.set(key, (fingerprint, response.status_code, body), timeout)
+        return response
+    return wrapper
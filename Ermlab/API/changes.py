@@ -0,0 +1,33 @@
+from django.conf import settings
+from .models import Car, Reservation, Change, BATCH_SIZE
+from .serializers import CarSerializer, ReservationSerializer
+
+SERIALIZERS = {
+    Car: CarSerializer,
+    Reservation: ReservationSerializer,
+}
+
+
+def is_enabled():
+    return getattr(settings, 'CHANGE_LOG_ENABLED', True)
+
+
+def record(op, instances):
+    """
+    Appends changes of cars or reservations to the change log with one query.
+    Saved objects are stored whole, for deleted and archived ones only id is stored
+    :param op: one of Change.OPERATIONS
+    :param instances: list of objects of class Car or Reservation
+    """
+
+    if not is_enabled() or not instances:
+        return
+    entries = []
+    for instance in instances:
+        if op == Change.SAVE:
+            payload = SERIALIZERS[type(instance)](instance).data
+        else:
+            payload = {'id': instance.pk}
+        entries.append(Change(model=type(instance).__name__.lower(), object_id=instance.pk, op=op, payload=payload))
+    Change.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
@@ -0,0 +1,45 @@
+from datetime import datetime
+from functools import lru_cache
+import re
+
+# Date, time, fraction of second and offset
+ISO_DATETIME = re.compile(r'(\d{4}-\d{2}-\d{2})[Tt ](\d{2}:\d{2}(?::\d{2})?)(?:[.,](\d+))?'
+                          r'\s*(Z|z|[+-]\d{2}(?::?\d{2})?)?')
+
+
+@lru_cache(maxsize=4096)
+def parse_iso_datetime(value):
+    """
+    Parses date and time in ISO 8601 format with datetime.fromisoformat. Variants which fromisoformat
+    doesn't accept in older versions of Python, like 'Z', offsets without colon and fractions
+    of any length, are normalized first. Results are cached, so retried and repeated dates are parsed once
+    :param value: string with date and time, e.g. "2021-01-20T10:00:00.5Z"
+    :return: Returns datetime, aware if offset is given, or None if value has wrong format
+    """
+
+    match = ISO_DATETIME.fullmatch(value.strip())
+    if match is None:
+        return None
+
+    date, time, fraction, offset = match.groups()
+    value = f'{date}T{time}'
+    if fraction:
+        value += '.' + fraction[:6].ljust(6, '0')
+    if offset in ('Z', 'z'):
+        value += '+00:00'
+    elif offset:
+        value += offset if ':' in offset else f'{offset[:3]}:{offset[3:] or "00"}'
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def to_datetime(value):
+    """
+    :param value: datetime or string in ISO 8601 format
+    :return: Returns datetime or None if string has wrong format
+    """
+
+    return parse_iso_datetime(value) if isinstance(value, str) else value
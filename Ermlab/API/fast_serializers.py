@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from .serializers import CarSerializer, MiniReservationSerializer
+
+
+def format_datetime(value, current_timezone=None):
+    """
+    Formats datetime the same way as DateTimeField of serializers
+    :param current_timezone: timezone of output, current one if not given
+    """
+
+    if value.utcoffset() is not None:
+        value = value.astimezone(current_timezone or timezone.get_current_timezone())
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def format_date(value, current_timezone=None):
+    return value.isoformat()
+
+
+def is_enabled():
+    return getattr(settings, 'FAST_SERIALIZATION_ENABLED', False)
+
+
+class FastSerializer:
+    """
+    Builds rows from values() of queryset without field introspection of ModelSerializer.
+    Fields and their formatting are taken once from model_serializer, output is the same as its output
+    """
+
+    model_serializer = None
+
+    def __init__(self, fields=None):
+        meta = self.model_serializer.Meta
+        names = meta.fields
+        if fields:
+            allowed = set(fields.split(','))
+            names = [name for name in names if name in allowed]
+
+        self.names = names
+        self.converters = []
+        for name in names:
+            field = meta.model._meta.get_field(name)
+            if isinstance(field, models.DateTimeField):
+                self.converters.append((name, format_datetime))
+            elif isinstance(field, models.DateField):
+                self.converters.append((name, format_date))
+
+    def get_queryset(self, queryset):
+        """
+        :return: Returns queryset of dicts with needed fields, id is always fetched for pagination
+        """
+
+        return queryset.values(*self.names, *(['id'] if 'id' not in self.names else []))
+
+    def to_representation(self, rows):
+        """
+        :param rows: dicts returned by queryset from get_queryset
+        :return: Returns list of formatted rows
+        """
+
+        names = self.names
+        converters = self.converters
+        current_timezone = timezone.get_current_timezone()
+        data = []
+        for row in rows:
+            item = {name: row[name] for name in names}
+            for name, convert in converters:
+                if item[name] is not None:
+                    item[name] = convert(item[name], current_timezone)
+            data.append(item)
+        return data
+
+
+class FastCarSerializer(FastSerializer):
+    model_serializer = CarSerializer
+
+
+class FastMiniReservationSerializer(FastSerializer):
+    model_serializer = MiniReservationSerializer
+
+
+FAST_SERIALIZERS = {
+    CarSerializer: FastCarSerializer,
+    MiniReservationSerializer: FastMiniReservationSerializer,
+}
@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.db import transaction
+from collections import OrderedDict
+from itertools import accumulate
+from bisect import bisect_left
+from threading import Lock
+import time
+
+
+class ReservationIndex:
+    """
+    In-process index of reservation periods of every car, kept as arrays sorted by date_from.
+    It answers if a period collides with any reservation in O(log n) without touching the database.
+    Cars are loaded lazily, dropped after RESERVATION_INDEX_TTL seconds and when their reservations change.
+    The database stays the source of truth, the index only rejects obvious collisions
+    """
+
+    def __init__(self):
+        self._cars = OrderedDict()
+        self._lock = Lock()
+        # Counters of invalidations of every car and of the whole index, periods loaded while they changed
+        # may be already stale, so they aren't kept
+        self._generations = {}
+        self._generation = 0
+
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, 'RESERVATION_INDEX_ENABLED', False)
+
+    def _load(self, car_id):
+        from .models import Reservation
+
+        periods = list(Reservation.objects.filter(booked_car=car_id).order_by('date_from')
+                       .values_list('pk', 'date_from', 'date_to'))
+        pks = [pk for pk, _, _ in periods]
+        starts = [date_from for _, date_from, _ in periods]
+        ends = [date_to for _, _, date_to in periods]
+        return time.monotonic(), pks, starts, ends, list(accumulate(ends, max))
+
+    def _get(self, car_id):
+        ttl = getattr(settings, 'RESERVATION_INDEX_TTL', 60)
+        with self._lock:
+            entry = self._cars.get(car_id)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                self._cars.move_to_end(car_id)
+                return entry
+            generation = (self._generation, self._generations.get(car_id, 0))
+
+        entry = self._load(car_id)
+        with self._lock:
+            if generation != (self._generation, self._generations.get(car_id, 0)):
+                return entry
+            self._cars[car_id] = entry
+            self._cars.move_to_end(car_id)
+            while len(self._cars) > getattr(settings, 'RESERVATION_INDEX_MAX_CARS', 10000):
+                self._cars.popitem(last=False)
+        return entry
+
+    def collides(self, car_id, new_from, new_to, reservation_to_miss=None):
+        """
+        :param car_id: primary key of the car
+        :param new_from: this is date when new reservation starts
+        :param new_to: this is date when new reservation ends
+        :param reservation_to_miss: miss this reservation if exist
+        :return: Returns True if period collides with any known reservation of the car
+        """
+
+        _, pks, starts, ends, latest_ends = self._get(car_id)
+        pk_to_miss = reservation_to_miss.pk if reservation_to_miss is not None else None
+
+        # Reservations which start before new one ends are checked from the latest one,
+        # until none of earlier reservations ends after new one starts
+        position = bisect_left(starts, new_to) - 1
+        while position >= 0 and latest_ends[position] > new_from:
+            if ends[position] > new_from and pks[position] != pk_to_miss:
+                return True
+            position -= 1
+        return False
+
+    def invalidate(self, car_id=None):
+        """
+        Drops periods of the car from the index, or the whole index if car isn't given.
+        Inside transaction they are dropped again after commit, because periods loaded before commit miss
+        the changes
+        """
+
+        def drop():
+            with self._lock:
+                if car_id is None:
+                    self._cars.clear()
+                    self._generations.clear()
+                    self._generation += 1
+                else:
+                    self._cars.pop(car_id, None)
+                    self._generations[car_id] = self._generations.get(car_id, 0) + 1
+
+        drop()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(drop)
+
+
+reservation_index = ReservationIndex()
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from API.models import ArchivedReservation
+from API.dates import parse_iso_datetime
+from datetime import timedelta
+import time
+
+
+class Command(BaseCommand):
+    help = "Moves reservations which ended before cutoff to archive. Every batch is moved in its own " \
+           "short transaction, so the command may run while the API is used"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Cutoff in ISO 8601 format, ARCHIVE_AFTER_DAYS ago if not given")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0, help="Seconds of pause between batches")
+
+    def handle(self, *args, **options):
+        if options['before']:
+            cutoff = parse_iso_datetime(options['before'])
+            if cutoff is None:
+                raise CommandError("Cutoff should be given in ISO 8601 format")
+            if timezone.is_naive(cutoff):
+                cutoff = timezone.make_aware(cutoff)
+        else:
+            cutoff = timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+        archived = 0
+        while True:
+            with transaction.atomic():
+                moved = ArchivedReservation.archive(cutoff, options['batch_size'])
+            if not moved:
+                break
+            archived += len(moved)
+            time.sleep(options['pause'])
+
+        self.stdout.write(f"Archived {archived} reservations which ended before {cutoff.isoformat()}")
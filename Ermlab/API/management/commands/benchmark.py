@@ -0,0 +1,154 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from API import benchmark
+from API.models import Car, Reservation
+from API.serializers import CarSerializer, MiniReservationSerializer
+from datetime import datetime, timedelta, timezone
+import random
+import json
+
+
+class Command(BaseCommand):
+    help = "Measures Reservation.is_period_valid, serializers and every endpoint of the API, then runs " \
+           "concurrent load against local HTTP server. Results are written as JSON. " \
+           "Data is created in a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=500)
+        parser.add_argument('--reservations', type=int, default=50, help="Reservations per car")
+        parser.add_argument('--repeat', type=int, default=50, help="Calls of every measured function or endpoint")
+        parser.add_argument('--requests', type=int, default=2000, help="Requests of load test")
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--cache', action='store_true', help="Keep caching of responses enabled")
+        parser.add_argument('--use-existing-database', action='store_true',
+                            help="Create and remove data in the configured database instead of a throwaway one, "
+                                 "cars with registration numbers starting with BENCH are deleted at the end")
+        parser.add_argument('--output', help="File for results, they are printed if not given")
+
+    def handle(self, *args, **options):
+        if options['use_existing_database']:
+            try:
+                results = self.run(options)
+            finally:
+                benchmark.clean()
+        else:
+            with benchmark.throwaway_database():
+                results = self.run(options)
+
+        output = json.dumps(results, indent=4)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run(self, options):
+        rand = random.Random(0)
+        car_ids = benchmark.seed(options['cars'], options['reservations'])
+        settings = {'ALLOWED_HOSTS': ['localhost', '127.0.0.1']}
+        if not options['cache']:
+            settings['RESPONSE_CACHE_TIMEOUT'] = 0
+        with override_settings(**settings):
+            return {
+                'options': {key: options[key] for key in ('cars', 'reservations', 'repeat', 'requests',
+                                                          'concurrency', 'cache')},
+                'functions': self.benchmark_functions(car_ids, options['repeat'], rand),
+                'endpoints': self.benchmark_endpoints(car_ids, options['repeat'], rand),
+                'load': self.benchmark_load(car_ids, options['requests'], options['concurrency'], rand),
+            }
+
+    @staticmethod
+    def random_period(rand):
+        date_from = datetime(2021, 1, 1, tzinfo=timezone.utc) + timedelta(hours=rand.randrange(0, 24 * 365))
+        return date_from, date_from + timedelta(hours=rand.randrange(1, 72))
+
+    @staticmethod
+    def summarize(times):
+        return {
+            'calls': len(times),
+            'mean_ms': round(sum(times) / len(times) * 1000, 3),
+            'p50_ms': round(benchmark.percentile(times, 0.5) * 1000, 3),
+            'p99_ms': round(benchmark.percentile(times, 0.99) * 1000, 3),
+        }
+
+    def benchmark_functions(self, car_ids, repeat, rand):
+        cars = list(Car.objects.filter(pk__in=rand.sample(car_ids, min(len(car_ids), repeat))))
+        page = list(Car.objects.filter(pk__in=car_ids).order_by('id')[:100])
+        reservations = list(Reservation.objects.filter(booked_car=car_ids[0]).order_by('id')[:100])
+
+        return {
+            'is_period_valid': self.summarize(benchmark.measure(
+                lambda: Reservation.is_period_valid(rand.choice(cars), *self.random_period(rand)), repeat)),
+            'CarSerializer_100_rows': self.summarize(benchmark.measure(
+                lambda: CarSerializer(page, many=True).data, repeat)),
+            'MiniReservationSerializer_100_rows': self.summarize(benchmark.measure(
+                lambda: MiniReservationSerializer(reservations, many=True).data, repeat)),
+        }
+
+    def benchmark_endpoints(self, car_ids, repeat, rand):
+        """
+        Calls endpoints of cars and reservations: lists, available cars, export, details of cars and reservations
+        and creation of cars, reservations and bulk reservations. Bulk cars, history, changes, examinations,
+        analytics, timelines and metrics aren't measured. Query count is taken from the last call
+        """
+
+        client = Client(HTTP_HOST='localhost')
+        car_id = car_ids[0]
+        reservation_id = Reservation.objects.filter(booked_car=car_id).values_list('id', flat=True).first()
+        numbers = iter(range(10 ** 9))
+
+        def new_reservation():
+            date_from, date_to = self.random_period(rand)
+            return {'booking_person': 'Benchmark', 'date_from': date_from.isoformat(),
+                    'date_to': date_to.isoformat()}
+
+        endpoints = {
+            'GET /api/cars': lambda: client.get('/api/cars'),
+            'GET /api/cars/available': lambda: client.get(
+                '/api/cars/available', {'from': '2021-03-01T00:00:00Z', 'to': '2021-03-02T00:00:00Z'}),
+            'GET /api/reservations': lambda: client.get('/api/reservations'),
+            'GET /api/reservations/export': lambda: client.get(
+                '/api/reservations/export', {'from': '2021-03-01T00:00:00Z', 'to': '2021-03-02T00:00:00Z'}),
+            'GET /api/car/<pk>': lambda: client.get(f'/api/car/{rand.choice(car_ids)}'),
+            'GET /api/car/<pk>/reservations': lambda: client.get(f'/api/car/{rand.choice(car_ids)}/reservations'),
+            'GET /api/car/<pk>/reservations/<pk2>': lambda: client.get(
+                f'/api/car/{car_id}/reservations/{reservation_id}'),
+            'POST /api/car/<pk>': lambda: client.post(f'/api/car/{car_id}', {
+                'brand': 'Opel', 'model': 'Benchmark',
+                'registration_number': f'{benchmark.REGISTRATION_PREFIX}N{next(numbers)}',
+                'date_of_next_technical_examination': '2030-01-01'}),
+            'POST /api/car/<pk>/reservations': lambda: client.post(
+                f'/api/car/{rand.choice(car_ids)}/reservations', new_reservation()),
+            'POST /api/car/<pk>/reservations/bulk': lambda: client.post(
+                f'/api/car/{rand.choice(car_ids)}/reservations/bulk', [new_reservation() for _ in range(100)],
+                content_type='application/json'),
+        }
+
+        def read(response):
+            # Streaming responses are produced while they are read
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+
+        results = {}
+        for name, call in endpoints.items():
+            times = benchmark.measure(lambda: read(call()), repeat)
+            with CaptureQueriesContext(connection) as context:
+                response = read(call())
+            results[name] = dict(self.summarize(times), queries=len(context.captured_queries),
+                                 status=response.status_code)
+        return results
+
+    def benchmark_load(self, car_ids, requests, concurrency, rand):
+        urls = [rand.choice([
+            '/api/cars?page_size=50',
+            '/api/cars/available?from=2021-03-01T00:00:00Z&to=2021-03-02T00:00:00Z',
+            f'/api/car/{rand.choice(car_ids)}',
+            f'/api/car/{rand.choice(car_ids)}/reservations',
+        ]) for _ in range(requests)]
+
+        with benchmark.local_server() as address:
+            latencies, elapsed, errors = benchmark.run_http(address, urls, concurrency)
+        return dict(benchmark.summarize(latencies, elapsed), errors=errors)
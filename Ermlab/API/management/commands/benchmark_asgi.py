@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from API import benchmark
+import json
+
+
+class Command(BaseCommand):
+    help = "Compares throughput of read endpoints served by WSGI, by ASGI with sync views " \
+           "and by ASGI with async views. Data is created in a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cars', type=int, default=200)
+        parser.add_argument('--reservations', type=int, default=20, help="Reservations per car")
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--use-existing-database', action='store_true',
+                            help="Create and remove data in the configured database instead of a throwaway one, "
+                                 "cars with registration numbers starting with BENCH are deleted at the end")
+
+    def handle(self, *args, **options):
+        if options['use_existing_database']:
+            try:
+                results = self.run(options)
+            finally:
+                benchmark.clean()
+        else:
+            with benchmark.throwaway_database():
+                results = self.run(options)
+
+        self.stdout.write(json.dumps(results, indent=4))
+
+    @staticmethod
+    def run(options):
+        car_ids = benchmark.seed(options['cars'], options['reservations'])
+        urls = [url for car_id in car_ids for url in (
+            "/api/cars?page_size=50",
+            "/api/cars/available?from=2021-03-01T00:00:00Z&to=2021-03-02T00:00:00Z",
+            f"/api/car/{car_id}",
+            f"/api/car/{car_id}/reservations",
+        )][:options['requests']]
+
+        results = {}
+        settings = {'ALLOWED_HOSTS': ['localhost'], 'RESPONSE_CACHE_TIMEOUT': 0}
+        with override_settings(ROOT_URLCONF='Ermlab.urls', **settings):
+            results['wsgi'] = benchmark.summarize(*benchmark.run_wsgi(urls, options['concurrency']))
+            results['asgi_sync_views'] = benchmark.summarize(*benchmark.run_asgi(urls, options['concurrency']))
+        with override_settings(ROOT_URLCONF='Ermlab.asgi_urls', **settings):
+            results['asgi_async_views'] = benchmark.summarize(*benchmark.run_asgi(urls, options['concurrency']))
+        return results
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from API.models import Car, Reservation
+from API.serializers import CarSerializer, MiniReservationSerializer
+from API.fast_serializers import FastCarSerializer, FastMiniReservationSerializer
+from API.renderers import FastJSONRenderer
+from API import benchmark
+from datetime import date, datetime, timedelta, timezone
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares ModelSerializers with fast serializers on lists of cars and reservations. " \
+           "Rows are created in transaction which is rolled back at the end"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, rows, repeat):
+        cars = Car.objects.bulk_create(
+            Car(brand='Opel', model='Astra', registration_number=f'BENCH{number}',
+                date_of_next_technical_examination=date(2030, 1, 1)) for number in range(rows))
+        car = Car.objects.filter(registration_number='BENCH0').first()
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        Reservation.objects.bulk_create(
+            Reservation(booking_person='Marcin', date_from=start + timedelta(hours=2 * number),
+                        date_to=start + timedelta(hours=2 * number + 1), booked_car=car) for number in range(rows))
+
+        cases = [
+            ("cars", Car.objects.filter(registration_number__startswith='BENCH').order_by('id'),
+             CarSerializer, FastCarSerializer),
+            ("reservations", Reservation.objects.filter(booked_car=car).order_by('id'),
+             MiniReservationSerializer, FastMiniReservationSerializer),
+        ]
+        for name, queryset, serializer_class, fast_serializer_class in cases:
+            def model_serialization():
+                return JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+
+            def fast_serialization():
+                serializer = fast_serializer_class()
+                return FastJSONRenderer().render(serializer.to_representation(serializer.get_queryset(queryset)))
+
+            if model_serialization() != fast_serialization():
+                raise CommandError(f"Fast serialization of {name} gives different output")
+
+            model_time = min(benchmark.measure(model_serialization, repeat))
+            fast_time = min(benchmark.measure(fast_serialization, repeat))
+            self.stdout.write(f"{name}: {len(cars)} rows, ModelSerializer {model_time * 1000:.1f} ms, "
+                              f"fast {fast_time * 1000:.1f} ms, speedup {model_time / fast_time:.1f}x")
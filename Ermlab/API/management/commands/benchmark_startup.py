@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from API import benchmark
+import json
+
+
+class Command(BaseCommand):
+    help = "Measures cold start: time from start of a new process to its first response of /api/cars " \
+           "and resident memory after boot, for every settings profile. Results are written as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=['Ermlab.settings', 'Ermlab.settings_api'],
+                            help="Settings modules to measure")
+        parser.add_argument('--runs', type=int, default=5, help="Started processes of every profile")
+        parser.add_argument('--budget-ms', type=float,
+                            help="Fail if median time to the first response of any profile is longer")
+        parser.add_argument('--output', help="File for results, they are printed if not given")
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("--runs has to be positive")
+
+        results = {}
+        for profile in options['profiles']:
+            try:
+                runs = [benchmark.run_startup(profile, connection.settings_dict['NAME'])
+                        for _ in range(options['runs'])]
+            except RuntimeError as error:
+                raise CommandError(error)
+            results[profile] = self.summarize(runs)
+
+        output = json.dumps(results, indent=4)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        budget = options['budget_ms']
+        over_budget = [profile for profile, result in results.items()
+                       if budget is not None and result['first_response_ms']['p50'] > budget]
+        if over_budget:
+            raise CommandError(f"Start of {', '.join(over_budget)} takes longer than {budget} ms")
+
+    @staticmethod
+    def summarize(runs):
+        summary = {'runs': len(runs), 'status': runs[-1]['status'], 'modules': runs[-1]['modules']}
+        for key in ('first_response_ms', 'boot_ms', 'request_ms', 'boot_rss_kb', 'max_rss_kb'):
+            values = [run[key] for run in runs if run[key] is not None]
+            if values:
+                summary[key] = {'p50': benchmark.percentile(values, 0.5), 'max': max(values)}
+        return summary
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from API.models import Reservation
+from API.dates import parse_iso_datetime
+from API.views import ExaminationBulk
+from API.fast_serializers import format_datetime
+import csv
+import json
+
+
+class Command(BaseCommand):
+    help = "Prints reservations which end after technical examination of their cars as JSON lines. " \
+           "Dates of examinations may be updated before from CSV file with rows: id of car, date"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help="Only cars with examination before this date are checked")
+        parser.add_argument('--after', help="Only reservations ending after this date are checked, now by default")
+        parser.add_argument('--updates', help="CSV file with new dates of examinations")
+
+    def handle(self, *args, **options):
+        try:
+            examination_before = parse_date(options['before']) if options['before'] else None
+            active_after = parse_iso_datetime(options['after']) if options['after'] else timezone.now()
+        except ValueError:
+            # Well formed date which doesn't exist, e.g. 2021-02-30
+            active_after = None
+        if active_after is None or (options['before'] and examination_before is None):
+            raise CommandError("Dates should be given in ISO 8601 format")
+        if timezone.is_naive(active_after):
+            active_after = timezone.make_aware(active_after)
+
+        if options['updates']:
+            dates = {}
+            with open(options['updates'], newline='') as updates:
+                for row in csv.reader(updates):
+                    if not row:
+                        continue
+                    try:
+                        car_id, date = int(row[0]), parse_date(row[1].strip())
+                    except (ValueError, IndexError):
+                        date = None
+                    if date is None:
+                        raise CommandError(f"Wrong row of updates: {','.join(row)}")
+                    dates[car_id] = date
+            with transaction.atomic():
+                result = ExaminationBulk.update_examinations(dates, active_after)
+            self.stderr.write(f"Updated {len(result['updated'])} cars, not found: {result['not_found']}")
+
+        conflicts = Reservation.get_examination_conflicts(examination_before, active_after).order_by('id')
+        for reservation in conflicts.iterator(chunk_size=2000):
+            car = reservation.booked_car
+            self.stdout.write(json.dumps({
+                'id': reservation.pk,
+                'booking_person': reservation.booking_person,
+                'date_from': format_datetime(reservation.date_from),
+                'date_to': format_datetime(reservation.date_to),
+                'car': car.pk,
+                'registration_number': car.registration_number,
+                'date_of_next_technical_examination': car.date_of_next_technical_examination.isoformat(),
+            }))
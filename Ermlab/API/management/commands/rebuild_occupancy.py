@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min, Max
+from API.models import ReservationHistory, DailyOccupancy
+from API.analytics import refresh_occupancy
+
+
+class Command(BaseCommand):
+    help = "Rebuilds daily occupancy rollup of all cars from their current and archived reservations"
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        DailyOccupancy.objects.all().delete()
+        periods = ReservationHistory.objects.values('booked_car').annotate(first=Min('date_from'), last=Max('date_to'))
+        cars = 0
+        for period in periods.order_by('booked_car').iterator():
+            refresh_occupancy(period['booked_car'], period['first'], period['last'])
+            cars += 1
+        self.stdout.write(f"Rebuilt occupancy of {cars} cars, {DailyOccupancy.objects.count()} days")
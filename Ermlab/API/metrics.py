@@ -0,0 +1,219 @@
+"""
+Metrics of requests exposed in Prometheus text format. Metrics are kept by every process separately
+"""
+
+from django.conf import settings
+from django.http import HttpResponse
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from pathlib import Path
+from threading import Lock
+import asyncio
+import cProfile
+import time
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.values = defaultdict(float)
+        self.lock = Lock()
+
+    def inc(self, amount=1, **labels):
+        with self.lock:
+            self.values[tuple(labels.items())] += amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(dict(labels))} {value}')
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Every series keeps counts of values in buckets, count and sum of values
+        self.values = defaultdict(lambda: [[0] * len(self.buckets), 0, 0.0])
+        self.lock = Lock()
+
+    def observe(self, value, **labels):
+        with self.lock:
+            series = self.values[tuple(labels.items())]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, (buckets, total, value_sum) in sorted(self.values.items()):
+                labels = dict(labels)
+                for bound, bucket in zip(self.buckets, buckets):
+                    lines.append(f'{self.name}_bucket{format_labels(dict(labels, le=bound))} {bucket}')
+                lines.append(f'{self.name}_bucket{format_labels(dict(labels, le="+Inf"))} {total}')
+                lines.append(f'{self.name}_count{format_labels(labels)} {total}')
+                lines.append(f'{self.name}_sum{format_labels(labels)} {value_sum}')
+        return lines
+
+
+request_duration = Histogram('api_request_duration_seconds', "Time of handling requests", DURATION_BUCKETS)
+request_queries = Histogram('api_request_db_queries', "Number of database queries per request", COUNT_BUCKETS)
+request_query_duration = Histogram('api_request_db_duration_seconds', "Time of database queries per request",
+                                   DURATION_BUCKETS)
+request_serialization_duration = Histogram('api_request_serialization_duration_seconds',
+                                           "Time of serialization and rendering per request", DURATION_BUCKETS)
+response_cache = Counter('api_response_cache_total', "Lookups of cached responses by result")
+idempotent_requests = Counter('api_idempotent_requests_total', "Requests with Idempotency-Key by result")
+
+METRICS = [request_duration, request_queries, request_query_duration, request_serialization_duration,
+           response_cache, idempotent_requests]
+
+# Statistics of request handled in current context
+current_request = ContextVar('current_request', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every database connection, it counts queries into statistics of request handled
+    in current context. Context is copied to threads which run sync code under ASGI, so their queries are counted too
+    """
+
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['queries'] += 1
+        stats['query_time'] += time.perf_counter() - started
+
+
+@contextmanager
+def track_serialization():
+    """
+    Adds time of the block to serialization time of current request
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_request.get()
+        if stats is not None:
+            stats['serialization_time'] += time.perf_counter() - started
+
+
+def expose():
+    return '\n'.join(line for metric in METRICS for line in metric.expose()) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    """
+    Records latency, database queries and serialization time of every request by route.
+    Every PROFILE_EVERY_N_REQUESTS-th request is profiled with cProfile and its stats are dumped to PROFILE_DIR.
+    Under ASGI the middleware runs in the event loop, so it doesn't force Django to switch threads for it
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.requests = count(1)
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as coroutine function, so Django awaits it
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        stats = {'queries': 0, 'query_time': 0.0, 'serialization_time': 0.0}
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.handle(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = {'queries': 0, 'query_time': 0.0, 'serialization_time': 0.0}
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.handle_async(request)
+        finally:
+            current_request.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def observe(request, response, stats, duration):
+        match = request.resolver_match
+        labels = {'route': match.route if match is not None else 'unmatched', 'method': request.method}
+        request_duration.observe(duration, status=response.status_code, **labels)
+        request_queries.observe(stats['queries'], **labels)
+        request_query_duration.observe(stats['query_time'], **labels)
+        request_serialization_duration.observe(stats['serialization_time'], **labels)
+
+    def is_profiled(self):
+        every = getattr(settings, 'PROFILE_EVERY_N_REQUESTS', 0)
+        return every and not next(self.requests) % every
+
+    def handle(self, request):
+        if not self.is_profiled():
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        response = profile.runcall(self.get_response, request)
+        self.dump_profile(profile, request)
+        return response
+
+    async def handle_async(self, request):
+        if not self.is_profiled():
+            return await self.get_response(request)
+
+        # Only the event loop is profiled, cProfile doesn't follow code run in threads by sync_to_async
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.disable()
+        self.dump_profile(profile, request)
+        return response
+
+    @staticmethod
+    def dump_profile(profile, request):
+        directory = Path(getattr(settings, 'PROFILE_DIR', 'profiles'))
+        directory.mkdir(parents=True, exist_ok=True)
+        name = request.path.strip('/').replace('/', '_') or 'root'
+        profile.dump_stats(directory / f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10 ** 9}-{name}.prof')
@@ -0,0 +1,35 @@
+# Generated by Django 3.1.5 on 2026-10-18 13:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Car',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('brand', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=50)),
+                ('registration_number', models.CharField(blank=True, max_length=15, null=True, unique=True)),
+                ('date_of_next_technical_examination', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booking_person', models.CharField(max_length=40)),
+                ('date_from', models.DateTimeField()),
+                ('date_to', models.DateTimeField()),
+                ('booked_car', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='API.car')),
+            ],
+        ),
+    ]
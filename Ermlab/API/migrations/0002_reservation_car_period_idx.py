@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 13:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['booked_car', 'date_from', 'date_to'], name='reservation_car_period_idx'),
+        ),
+    ]
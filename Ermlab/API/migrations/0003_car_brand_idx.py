@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0002_reservation_car_period_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['brand', 'id'], name='car_brand_idx'),
+        ),
+    ]
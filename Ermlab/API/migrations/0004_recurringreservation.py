@@ -0,0 +1,34 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0003_car_brand_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecurringReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booking_person', models.CharField(max_length=40)),
+                ('date_from', models.DateTimeField()),
+                ('date_to', models.DateTimeField()),
+                ('frequency', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly')], max_length=6)),
+                ('interval', models.PositiveIntegerField(default=1)),
+                ('weekdays', models.CharField(blank=True, default='', max_length=13)),
+                ('count', models.PositiveIntegerField(blank=True, null=True)),
+                ('until', models.DateTimeField(blank=True, null=True)),
+                ('booked_car', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='API.car')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='recurring_reservation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='API.recurringreservation'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0004_recurringreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('booked', models.DurationField()),
+                ('car', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='API.car')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailyoccupancy',
+            index=models.Index(fields=['day', 'car'], name='occupancy_day_car_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyoccupancy',
+            constraint=models.UniqueConstraint(fields=('car', 'day'), name='occupancy_car_day_uniq'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0005_dailyoccupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('booking_person', models.CharField(max_length=40)),
+                ('date_from', models.DateTimeField()),
+                ('date_to', models.DateTimeField()),
+                ('archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'API_reservationhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('booking_person', models.CharField(max_length=40)),
+                ('date_from', models.DateTimeField()),
+                ('date_to', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('booked_car', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='API.car')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedreservation',
+            index=models.Index(fields=['booked_car', 'date_from', 'date_to'], name='archived_car_period_idx'),
+        ),
+        migrations.RunSQL(
+            sql='CREATE VIEW "API_reservationhistory" AS '
+                'SELECT id, booking_person, date_from, date_to, booked_car_id, FALSE AS archived '
+                'FROM "API_reservation" '
+                'UNION ALL '
+                'SELECT id, booking_person, date_from, date_to, booked_car_id, TRUE AS archived '
+                'FROM "API_archivedreservation"',
+            reverse_sql='DROP VIEW "API_reservationhistory"',
+        ),
+    ]
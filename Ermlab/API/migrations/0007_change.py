@@ -0,0 +1,24 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0006_archivedreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('op', models.CharField(choices=[('save', 'Save'), ('delete', 'Delete'), ('archive', 'Archive')], max_length=7)),
+                ('payload', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
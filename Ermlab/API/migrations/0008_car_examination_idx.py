@@ -0,0 +1,17 @@
+# Generated by Django 3.1.5 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('API', '0007_change'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='car',
+            index=models.Index(fields=['date_of_next_technical_examination'], name='car_examination_idx'),
+        ),
+    ]
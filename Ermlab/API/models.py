@@ -1,5 +1,49 @@
-from django.db import models
-from datetime import datetime
+from django.conf import settings
+from django.db import models, connection
+from django.dispatch import Signal
+from django.db.models import F, Exists, OuterRef
+from django.utils.timezone import is_aware, make_aware, now
+from datetime import datetime, time, timedelta, timezone
+from collections import defaultdict
+from itertools import accumulate
+from bisect import bisect_left
+from .interval_index import reservation_index
+from .dates import to_datetime
+
+# Maximal number of values put into single `IN` clause
+BATCH_SIZE = 500
+# Maximal number of occurrences of one recurring reservation
+MAX_OCCURRENCES = 1000
+
+# Sent with `reservations`, dict of ids of archived reservations mapped to ids of their cars
+reservations_archived = Signal()
+
+
+def create_all(objects):
+    """
+    Inserts new objects of one model with bulk_create in batches of BATCH_SIZE and sets their primary keys.
+    Databases which don't return inserted rows, like SQLite, get keys read back from the last rows of the table,
+    matched to objects by values of their fields. Has to be called inside transaction.atomic(), so no other
+    transaction inserts rows before they are read
+    :param objects: list of unsaved objects of the same model
+    """
+
+    if not objects:
+        return
+    model = type(objects[0])
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    if objects[0].pk is not None:
+        return
+
+    fields = [field.attname for field in model._meta.concrete_fields if not field.primary_key]
+    unassigned = defaultdict(list)
+    for instance in objects:
+        unassigned[tuple(getattr(instance, field) for field in fields)].append(instance)
+    rows = model.objects.order_by('-pk')[:len(objects)].values_list('pk', *fields)
+    for pk, *values in list(rows)[::-1]:
+        instances = unassigned.get(tuple(values))
+        if instances:
+            instances.pop(0).pk = pk
 
 
 class Car(models.Model):
@@ -8,15 +52,87 @@ class Car(models.Model):
     registration_number = models.CharField(max_length=15, unique=True, null=True, blank=True)
     date_of_next_technical_examination = models.DateField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['brand', 'id'], name='car_brand_idx'),
+            models.Index(fields=['date_of_next_technical_examination'], name='car_examination_idx'),
+        ]
+
     def __str__(self):
         return f"{self.brand} - {self.model} - {self.registration_number}"
 
+    @staticmethod
+    def lock_for_booking(*pks):
+        """
+        Locks the cars until the end of current transaction, so concurrent bookings of one car are serialized.
+        Has to be called inside transaction.atomic()
+        :param pks: primary keys of the cars
+        :return: Returns queryset which reads the locked cars
+        """
+
+        if connection.features.has_select_for_update:
+            return Car.objects.select_for_update().filter(pk__in=pks).order_by('pk')
+
+        # SQLite has no row locks, so the write lock is taken before reservations are checked.
+        # Any write locks whole database, so updating one car is enough
+        Car.objects.filter(pk__in=pks[:1]).update(brand=F('brand'))
+        return Car.objects.filter(pk__in=pks)
+
+    @staticmethod
+    def get_available(new_from, new_to):
+        """
+        Applies rules of Reservation.is_period_valid to whole fleet with one query
+        :param new_from: this is date when new reservation starts
+        :param new_to: this is date when new reservation ends
+        :return: Returns queryset of cars which can be booked in given period
+        """
+
+        colliding = Reservation.objects.filter(booked_car=OuterRef('pk'), date_from__lt=new_to, date_to__gt=new_from)
+        return Car.objects.filter(date_of_next_technical_examination__gte=new_to.date()).exclude(Exists(colliding))
+
+    @staticmethod
+    def update_examinations(dates):
+        """
+        Sets new dates of technical examination with one update query per BATCH_SIZE cars
+        :param dates: dict of car ids mapped to dates of next technical examination
+        :return: Returns list of updated cars
+        """
+
+        cars = []
+        car_ids = list(dates)
+        for start in range(0, len(car_ids), BATCH_SIZE):
+            cars.extend(Car.objects.filter(pk__in=car_ids[start:start + BATCH_SIZE]))
+        for car in cars:
+            car.date_of_next_technical_examination = dates[car.pk]
+        Car.objects.bulk_update(cars, ['date_of_next_technical_examination'], batch_size=BATCH_SIZE)
+        return cars
+
+    @staticmethod
+    def get_taken_registration_numbers(registration_numbers):
+        """
+        :param registration_numbers: list of registration numbers to check
+        :return: Returns set of registration numbers which are already used by some car
+        """
+
+        taken = set()
+        for start in range(0, len(registration_numbers), BATCH_SIZE):
+            taken.update(Car.objects.filter(registration_number__in=registration_numbers[start:start + BATCH_SIZE])
+                         .values_list('registration_number', flat=True))
+        return taken
+
 
 class Reservation(models.Model):
     booking_person = models.CharField(max_length=40)
     date_from = models.DateTimeField()
     date_to = models.DateTimeField()
     booked_car = models.ForeignKey(Car, on_delete=models.PROTECT)
+    recurring_reservation = models.ForeignKey('RecurringReservation', on_delete=models.CASCADE, null=True,
+                                              blank=True, related_name='occurrences')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['booked_car', 'date_from', 'date_to'], name='reservation_car_period_idx'),
+        ]
 
     def __str__(self):
         return f"Reservation from {self.date_from} to {self.date_to} for car {self.booked_car}"
@@ -30,6 +146,62 @@ class Reservation(models.Model):
 
         return [reservation for reservation in Reservation.objects.filter(booked_car=car)]
 
+    @staticmethod
+    def get_all(include_archived=False):
+        """
+        :param include_archived: if set, reservations moved to archive are included
+        :return: Returns queryset of reservations
+        """
+
+        return ReservationHistory.objects.all() if include_archived else Reservation.objects.all()
+
+    @staticmethod
+    def get_with_details(include_archived=False):
+        """
+        :param include_archived: if set, reservations moved to archive are included
+        :return: Returns queryset of reservations which fetches booked cars in the same query
+        """
+
+        return Reservation.get_all(include_archived).select_related('booked_car').only(
+            'id', 'booking_person', 'date_from', 'date_to', 'booked_car', 'booked_car__brand', 'booked_car__model',
+            'booked_car__registration_number', 'booked_car__date_of_next_technical_examination')
+
+    @staticmethod
+    def get_examination_conflicts(examination_before=None, active_after=None, car_ids=None):
+        """
+        Finds reservations which end after the day of technical examination of their cars, with one join query
+        :param examination_before: if given, only cars with examination before this date are checked
+        :param active_after: if given, only reservations ending after this date are checked
+        :param car_ids: if given, only reservations of these cars are checked
+        :return: Returns queryset of conflicting reservations which fetches their cars in the same query
+        """
+
+        reservations = Reservation.get_with_details().filter(
+            date_to__date__gt=F('booked_car__date_of_next_technical_examination'))
+        if examination_before is not None:
+            reservations = reservations.filter(booked_car__date_of_next_technical_examination__lt=examination_before)
+        if active_after is not None:
+            reservations = reservations.filter(date_to__gt=active_after)
+        if car_ids is not None:
+            reservations = reservations.filter(booked_car__in=car_ids)
+        return reservations
+
+    @staticmethod
+    def get_colliding_reservations(car, new_from, new_to, reservation_to_miss=None):
+        """
+        Builds a query for reservations of the car which overlap given period
+        :param car: should be an object of class Car
+        :param new_from: this is date when new reservation starts
+        :param new_to: this is date when new reservation ends
+        :param reservation_to_miss: miss this reservation if exist
+        :return: Returns queryset of colliding reservations
+        """
+
+        reservations = Reservation.objects.filter(booked_car=car, date_from__lt=new_to, date_to__gt=new_from)
+        if reservation_to_miss is not None:
+            reservations = reservations.exclude(pk=reservation_to_miss.pk)
+        return reservations
+
     @staticmethod
     def is_period_valid(choosed_car, new_from, new_to, reservation_to_miss=None):
         """
@@ -40,37 +212,382 @@ class Reservation(models.Model):
         :param reservation_to_miss: miss this reservation if exist
         """
 
-        # Creates a list of tuples with dates of reservations
-        dates_of_reservations = []
-        for reservation in Reservation.get_reservations(choosed_car):
-            if reservation == reservation_to_miss:
-                continue
-            else:
-                dates_of_reservations.append((reservation.date_from, reservation.date_to))
-
         # Converts string into datetime object if needed
-        new_from = datetime.strptime(new_from, '%Y-%m-%dT%H:%M:%S%z') if not isinstance(new_from,
-                                                                                        datetime) else new_from
-        new_to = datetime.strptime(new_to, '%Y-%m-%dT%H:%M:%S%z') if not isinstance(new_to, datetime) else new_to
-
-        if choosed_car.date_of_next_technical_examination >= new_to.date():
-            if new_from <= new_to:
-                if dates_of_reservations:
-                    for reservation in dates_of_reservations:
-                        if any(map(lambda x: reservation[0] <= x <= reservation[1], (new_from, new_to))) or (
-                                new_from <= reservation[0] and new_to >= reservation[1]):
-                            return False
-                    return True
-                else:
-                    return True
-            else:
-                return False
-        else:
+        new_from, new_to = to_datetime(new_from), to_datetime(new_to)
+        if new_from is None or new_to is None:
+            return False
+
+        if choosed_car.date_of_next_technical_examination < new_to.date():
+            return False
+        if new_from > new_to:
             return False
 
+        # Obvious collisions are rejected by in-process index without touching the database
+        if reservation_index.is_enabled() and reservation_index.collides(choosed_car.pk, new_from, new_to,
+                                                                         reservation_to_miss):
+            return False
+
+        # Collision is checked by the database with single indexed query
+        return not Reservation.get_colliding_reservations(choosed_car, new_from, new_to, reservation_to_miss).exists()
+
+    @staticmethod
+    def get_valid_in_batch(new_reservations):
+        """
+        The method checks whole batch of new reservations against existing ones and against each other
+        with one sorted sweep per car. If reservations from batch collide, the one starting earlier wins
+        :param new_reservations: list of unsaved reservations with booked_car set
+        :return: Returns list of booleans, True for reservations which can be saved
+        """
+
+        valid = [False] * len(new_reservations)
+
+        # Groups reservations with correct dates by car
+        reservations_of_car = defaultdict(list)
+        for reservation in new_reservations:
+            if reservation.date_from <= reservation.date_to and \
+                    reservation.booked_car.date_of_next_technical_examination >= reservation.date_to.date():
+                reservations_of_car[reservation.booked_car_id].append(reservation)
+        if not reservations_of_car:
+            return valid
+
+        # Fetches existing reservations of all cars from batch which may collide, BATCH_SIZE cars per query
+        period_from = min(reservation.date_from for reservations in reservations_of_car.values()
+                          for reservation in reservations)
+        period_to = max(reservation.date_to for reservations in reservations_of_car.values()
+                        for reservation in reservations)
+        car_ids = list(reservations_of_car)
+        existing_of_car = defaultdict(list)
+        for start in range(0, len(car_ids), BATCH_SIZE):
+            existing = Reservation.objects.filter(booked_car__in=car_ids[start:start + BATCH_SIZE],
+                                                  date_from__lt=period_to, date_to__gt=period_from)
+            for car_id, date_from, date_to in existing.order_by('date_from').values_list('booked_car', 'date_from',
+                                                                                          'date_to'):
+                existing_of_car[car_id].append((date_from, date_to))
+
+        positions = {id(reservation): index for index, reservation in enumerate(new_reservations)}
+        for car_id, reservations in reservations_of_car.items():
+            existing = existing_of_car[car_id]
+            starts = [date_from for date_from, _ in existing]
+            latest_ends = list(accumulate((date_to for _, date_to in existing), max))
+            accepted_end = None
+
+            for reservation in sorted(reservations, key=lambda r: r.date_from):
+                # Existing reservations which start before new one ends collide if any of them ends after it starts
+                position = bisect_left(starts, reservation.date_to)
+                if position and latest_ends[position - 1] > reservation.date_from:
+                    continue
+                if accepted_end is not None and accepted_end > reservation.date_from:
+                    continue
+                valid[positions[id(reservation)]] = True
+                accepted_end = reservation.date_to if accepted_end is None else max(accepted_end, reservation.date_to)
+
+        return valid
+
+    @staticmethod
+    def get_colliding_periods(car, periods):
+        """
+        Checks many periods of one car against existing reservations with one query and single merged sweep
+        over both sorted lists, periods are also checked against each other
+        :param car: should be an object of class Car
+        :param periods: list of tuples (date_from, date_to) sorted by date_from
+        :return: Returns list of periods which can't be booked
+        """
+
+        if not periods:
+            return []
+
+        period_to = max(date_to for _, date_to in periods)
+        existing = Reservation.objects.filter(booked_car=car, date_from__lt=period_to, date_to__gt=periods[0][0])
+        existing = list(existing.order_by('date_from').values_list('date_from', 'date_to'))
+
+        colliding = []
+        position = 0
+        # The latest end of existing reservations starting before current period ends
+        latest_end = None
+        previous_end = None
+        for date_from, date_to in periods:
+            while position < len(existing) and existing[position][0] < date_to:
+                if latest_end is None or existing[position][1] > latest_end:
+                    latest_end = existing[position][1]
+                position += 1
+            if date_from > date_to or car.date_of_next_technical_examination < date_to.date() or \
+                    (latest_end is not None and latest_end > date_from) or \
+                    (previous_end is not None and previous_end > date_from):
+                colliding.append((date_from, date_to))
+            previous_end = date_to if previous_end is None else max(previous_end, date_to)
+
+        return colliding
+
+    @staticmethod
+    def get_timelines(cars, period_from, period_to):
+        """
+        Builds merged busy periods and free gaps between them for every car inside given period,
+        with one ordered query per BATCH_SIZE cars and linear merge. Car is free only until the end of the day
+        of its technical examination
+        :param cars: list of objects of class Car
+        :param period_from: this is date when period starts
+        :param period_to: this is date when period ends
+        :return: Returns dict of car id mapped to tuple of lists of busy and free periods (date_from, date_to)
+        """
+
+        timelines = {car.pk: ([], []) for car in cars}
+        car_ids = list(timelines)
+        for start in range(0, len(car_ids), BATCH_SIZE):
+            reservations = Reservation.objects.filter(booked_car__in=car_ids[start:start + BATCH_SIZE],
+                                                      date_from__lt=period_to, date_to__gt=period_from)
+            for car_id, date_from, date_to in reservations.order_by('booked_car', 'date_from').values_list(
+                    'booked_car', 'date_from', 'date_to'):
+                busy = timelines[car_id][0]
+                date_from, date_to = max(date_from, period_from), min(date_to, period_to)
+                # Overlapping and touching reservations are merged into one busy period
+                if busy and busy[-1][1] >= date_from:
+                    busy[-1] = (busy[-1][0], max(busy[-1][1], date_to))
+                else:
+                    busy.append((date_from, date_to))
+
+        for car in cars:
+            busy, free = timelines[car.pk]
+            available_until = datetime.combine(car.date_of_next_technical_examination + timedelta(days=1), time(),
+                                               tzinfo=timezone.utc)
+            available_until = min(available_until, period_to)
+            start = period_from
+            for date_from, date_to in busy + [(available_until, available_until)]:
+                end = min(date_from, available_until)
+                if start < end:
+                    free.append((start, end))
+                start = max(start, date_to)
+
+        return timelines
+
     @staticmethod
     def get_reason_of_error():
         return "You can't put this reservation due to one of the followings reason: " \
                "1) There is another reservation is this time " \
                "2) Reservation ends earlier than starts! " \
                "3) In this period car's technical examination is planned"
+
+
+class RecurringReservation(models.Model):
+    """
+    Rule of reservation repeated every day or week, similar to RRULE of iCalendar.
+    date_from and date_to set time and length of occurrences and the earliest start
+    """
+
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    FREQUENCIES = [(DAILY, 'Daily'), (WEEKLY, 'Weekly')]
+
+    booking_person = models.CharField(max_length=40)
+    date_from = models.DateTimeField()
+    date_to = models.DateTimeField()
+    booked_car = models.ForeignKey(Car, on_delete=models.PROTECT)
+    frequency = models.CharField(max_length=6, choices=FREQUENCIES)
+    interval = models.PositiveIntegerField(default=1)
+    # Comma separated numbers of weekdays, 0 is Monday. Empty means any day for daily and day of date_from for weekly
+    weekdays = models.CharField(max_length=13, blank=True, default='')
+    count = models.PositiveIntegerField(null=True, blank=True)
+    until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Recurring {self.frequency} reservation from {self.date_from} for car {self.booked_car}"
+
+    def get_weekdays(self):
+        """
+        :return: Returns set of weekdays on which occurrences start
+        """
+
+        if self.weekdays:
+            return {int(weekday) for weekday in self.weekdays.split(',')}
+        if self.frequency == RecurringReservation.WEEKLY:
+            return {self.date_from.weekday()}
+        return set(range(7))
+
+    def get_occurrences(self, period_from=None, period_to=None, limit=MAX_OCCURRENCES):
+        """
+        Expands the rule lazily, occurrences are generated in order of start
+        :param period_from: if given, skips occurrences which end before it, without offset it's in TIME_ZONE
+        :param period_to: if given, stops at occurrences which start after it, without offset it's in TIME_ZONE
+        :param limit: maximal number of expanded occurrences when the rule has no count
+        :return: Returns generator of tuples (date_from, date_to)
+        """
+
+        if period_from is not None and not is_aware(period_from):
+            period_from = make_aware(period_from)
+        if period_to is not None and not is_aware(period_to):
+            period_to = make_aware(period_to)
+        weekdays = self.get_weekdays()
+        duration = self.date_to - self.date_from
+        first_monday = self.date_from.date() - timedelta(days=self.date_from.weekday())
+        generated = 0
+        day = 0
+
+        while generated < min(self.count or limit, limit):
+            date_from = self.date_from + timedelta(days=day)
+            day += 1
+            if self.until is not None and date_from > self.until:
+                return
+            if period_to is not None and date_from >= period_to:
+                return
+            if date_from.weekday() not in weekdays:
+                continue
+            if self.frequency == RecurringReservation.WEEKLY:
+                if (date_from.date() - first_monday).days // 7 % self.interval:
+                    continue
+            elif (day - 1) % self.interval:
+                continue
+
+            generated += 1
+            if period_from is None or date_from + duration > period_from:
+                yield date_from, date_from + duration
+
+
+class DailyOccupancy(models.Model):
+    """
+    Rollup of booked time of the car per day, maintained when reservations change if OCCUPANCY_ROLLUP_ENABLED is set
+    """
+
+    car = models.ForeignKey(Car, on_delete=models.CASCADE)
+    day = models.DateField()
+    booked = models.DurationField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['car', 'day'], name='occupancy_car_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'car'], name='occupancy_day_car_idx'),
+        ]
+
+    def __str__(self):
+        return f"Car {self.car_id} booked for {self.booked} on {self.day}"
+
+
+class ArchivedReservation(models.Model):
+    """
+    Reservation which ended before archive cutoff, moved out of the table used by collision checks.
+    Keeps id of the original reservation
+    """
+
+    id = models.IntegerField(primary_key=True)
+    booking_person = models.CharField(max_length=40)
+    date_from = models.DateTimeField()
+    date_to = models.DateTimeField()
+    booked_car = models.ForeignKey(Car, on_delete=models.PROTECT)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['booked_car', 'date_from', 'date_to'], name='archived_car_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived reservation from {self.date_from} to {self.date_to} for car {self.booked_car}"
+
+    @staticmethod
+    def archive(cutoff, batch_size=BATCH_SIZE):
+        """
+        Moves one batch of reservations which ended before cutoff to archive and sends reservations_archived.
+        Has to be called inside transaction.atomic(), so the batch is copied and deleted at once
+        :param cutoff: reservations ending before this date are archived
+        :param batch_size: maximal number of reservations moved at once
+        :return: Returns dict of ids of moved reservations mapped to ids of their cars
+        """
+
+        reservations = list(Reservation.objects.filter(date_to__lt=cutoff).order_by('pk')[:batch_size]
+                            .values_list('pk', 'booking_person', 'date_from', 'date_to', 'booked_car'))
+        if not reservations:
+            return {}
+
+        ArchivedReservation.objects.bulk_create([
+            ArchivedReservation(id=pk, booking_person=booking_person, date_from=date_from, date_to=date_to,
+                                booked_car_id=car_id)
+            for pk, booking_person, date_from, date_to, car_id in reservations], ignore_conflicts=True)
+        # Rows are deleted without post_delete signals, archived reservations stay in occupancy rollup and
+        # are announced once for the batch by reservations_archived
+        pks = [pk for pk, *_ in reservations]
+        table = connection.ops.quote_name(Reservation._meta.db_table)
+        column = connection.ops.quote_name(Reservation._meta.pk.column)
+        with connection.cursor() as cursor:
+            for start in range(0, len(pks), BATCH_SIZE):
+                batch = pks[start:start + BATCH_SIZE]
+                cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(batch))})", batch)
+        archived = {pk: car_id for pk, *_, car_id in reservations}
+        reservations_archived.send(sender=ArchivedReservation, reservations=archived)
+        return archived
+
+
+class ReservationHistory(models.Model):
+    """
+    Read only database view of current and archived reservations
+    """
+
+    booking_person = models.CharField(max_length=40)
+    date_from = models.DateTimeField()
+    date_to = models.DateTimeField()
+    booked_car = models.ForeignKey(Car, on_delete=models.DO_NOTHING, db_constraint=False)
+    archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'API_reservationhistory'
+
+    def __str__(self):
+        return f"Reservation from {self.date_from} to {self.date_to} for car {self.booked_car}"
+
+
+class Change(models.Model):
+    """
+    Append-only log of changes of cars and reservations, id is sequence number of the change
+    """
+
+    SAVE = 'save'
+    DELETE = 'delete'
+    ARCHIVE = 'archive'
+    OPERATIONS = [(SAVE, 'Save'), (DELETE, 'Delete'), (ARCHIVE, 'Archive')]
+
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    op = models.CharField(max_length=7, choices=OPERATIONS)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Change {self.id}: {self.op} of {self.model} {self.object_id}"
+
+    @staticmethod
+    def get_since(since, limit):
+        """
+        Sequence numbers are taken when changes are inserted, not when they are committed, so a transaction may
+        commit after a later one. Changes after a gap in sequence are returned only when they are older than
+        CHANGE_LOG_LAG seconds, until then the gap may belong to a transaction which isn't committed yet and
+        clients which moved past it would never see it
+        :param since: sequence number of the last change known to the client
+        :param limit: maximal number of returned changes
+        :return: Returns list of dicts of changes made after given one, in order of sequence
+        """
+
+        entries = list(Change.objects.filter(id__gt=since).order_by('id')[:limit]
+                       .values('id', 'model', 'object_id', 'op', 'payload', 'created_at'))
+        settled = now() - timedelta(seconds=getattr(settings, 'CHANGE_LOG_LAG', 5))
+        expected = since + 1
+        for index, entry in enumerate(entries):
+            if entry['id'] != expected and entry['created_at'] > settled:
+                return entries[:index]
+            expected = entry['id'] + 1
+        return entries
+
+    @staticmethod
+    def prune(cutoff, batch_size=BATCH_SIZE):
+        """
+        Deletes one batch of changes made before cutoff, the oldest first
+        :param cutoff: changes created before this date are deleted
+        :param batch_size: maximal number of changes deleted at once
+        :return: Returns number of deleted changes
+        """
+
+        pks = list(Change.objects.filter(created_at__lt=cutoff).order_by('id')[:batch_size]
+                   .values_list('id', flat=True))
+        if not pks:
+            return 0
+        return Change.objects.filter(id__in=pks).delete()[0]
@@ -0,0 +1,129 @@
+"""
+Routing of reads to replica databases. Reads of safe requests go to replicas, everything else,
+including booking path with is_period_valid and save, goes to the primary `default` database
+"""
+from django.conf import settings
+from contextlib import contextmanager
+from contextvars import ContextVar
+import asyncio
+import random
+import time
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Cookie with time until which the client reads from the primary after its own write
+STICKY_COOKIE = 'primary_until'
+
+# Replica chosen for reads of current request, None when reads go to the primary
+replica_database = ContextVar('replica_database', default=None)
+
+
+def get_replicas():
+    return getattr(settings, 'REPLICA_DATABASES', [])
+
+
+@contextmanager
+def use_replica(database):
+    """
+    Sends reads in the block to given replica, or to the primary if it's None
+    """
+
+    token = replica_database.set(database)
+    try:
+        yield
+    finally:
+        replica_database.reset(token)
+
+
+def stream_from(content, database):
+    """
+    Iterates streaming content with reads sent to given replica. Content is produced after the middleware
+    has returned the response, so the replica is chosen again for every chunk
+    """
+
+    chunks = iter(content)
+    while True:
+        with use_replica(database):
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+        yield chunk
+
+
+class ReplicaRouter:
+    """
+    Sends reads to replica chosen for current request, writes and migrations to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        database = replica_database.get()
+        if database is not None and database in get_replicas():
+            return database
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas contain the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
+
+
+class ReplicaMiddleware:
+    """
+    Sends reads of safe requests to one replica chosen at random, so all queries of the request see data
+    in the same state. After a write the client reads from the primary for REPLICA_STICKY_SECONDS,
+    so it sees its own changes despite replication lag
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as coroutine function, so Django awaits it
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        database = self.choose_database(request)
+        with use_replica(database):
+            response = self.get_response(request)
+        return self.process_response(request, response, database)
+
+    async def __acall__(self, request):
+        database = self.choose_database(request)
+        with use_replica(database):
+            response = await self.get_response(request)
+        return self.process_response(request, response, database)
+
+    @staticmethod
+    def choose_database(request):
+        """
+        :return: Returns replica for reads of the request or None if they go to the primary
+        """
+
+        replicas = get_replicas()
+        if not replicas or request.method not in SAFE_METHODS:
+            return None
+        try:
+            sticky = float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        return None if sticky else random.choice(replicas)
+
+    @staticmethod
+    def process_response(request, response, database):
+        if database is not None and response.streaming:
+            response.streaming_content = stream_from(response.streaming_content, database)
+        if get_replicas() and request.method not in SAFE_METHODS:
+            sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + sticky_seconds), max_age=sticky_seconds,
+                                httponly=True, samesite='Lax')
+        return response
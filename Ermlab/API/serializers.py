@@ -1,20 +1,96 @@
+from django.db import models
 from rest_framework import serializers
-from .models import Car, Reservation
+from .models import Car, Reservation, RecurringReservation, MAX_OCCURRENCES
+from .dates import parse_iso_datetime
+from datetime import datetime
 
+# Code of validation error of reservation which collides with others or with technical examination
+PERIOD_ERROR_CODE = 'period'
 
-class CarSerializer(serializers.ModelSerializer):
+
+def has_period_error(errors):
+    """
+    :param errors: errors of reservation serializer
+    :return: Returns True if reservation was rejected because of its period
+    """
+
+    return any(error.code == PERIOD_ERROR_CODE for error in errors.get('non_field_errors', []))
+
+
+class IsoDateTimeField(serializers.DateTimeField):
+    """
+    Parses dates with shared cached parser, which accepts ISO 8601 variants sent by clients
+    """
+
+    def to_internal_value(self, value):
+        if isinstance(value, datetime):
+            return super().to_internal_value(value)
+        parsed = parse_iso_datetime(value) if isinstance(value, str) else None
+        if parsed is None:
+            self.fail('invalid', format='ISO 8601')
+        return self.enforce_timezone(parsed)
+
+
+class SparseFieldsMixin:
+    """
+    Limits returned fields to the ones given as comma separated string, e.g. fields="id,brand"
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            allowed = set(fields.split(','))
+            for field_name in set(self.fields) - allowed:
+                self.fields.pop(field_name)
+
+
+class CarSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Car
         fields = ['id', 'brand', 'model', 'registration_number', 'date_of_next_technical_examination']
 
 
-class MiniReservationSerializer(serializers.ModelSerializer):
+class BulkCarSerializer(CarSerializer):
+    """
+    Uniqueness of registration numbers is checked for whole batch at once, not by query per car
+    """
+
+    class Meta(CarSerializer.Meta):
+        extra_kwargs = {'registration_number': {'validators': []}}
+
+
+class IsoDateTimeMixin:
+    """
+    Date and time fields of model serializer are parsed by IsoDateTimeField
+    """
+
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping,
+                                models.DateTimeField: IsoDateTimeField}
+
+
+class PeriodValidationMixin(IsoDateTimeMixin):
+    """
+    Parsed dates are checked against other reservations of the car given as `car` in context.
+    Rejected period is reported as non field error with PERIOD_ERROR_CODE
+    """
+
+    def validate(self, data):
+        car = self.context.get('car')
+        if car is not None:
+            date_from = data.get('date_from', getattr(self.instance, 'date_from', None))
+            date_to = data.get('date_to', getattr(self.instance, 'date_to', None))
+            if not Reservation.is_period_valid(car, date_from, date_to, self.instance):
+                raise serializers.ValidationError(Reservation.get_reason_of_error(), code=PERIOD_ERROR_CODE)
+        return data
+
+
+class MiniReservationSerializer(SparseFieldsMixin, PeriodValidationMixin, serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = ['id', 'booking_person', 'date_from', 'date_to']
 
 
-class ReservationSerializer(serializers.ModelSerializer):
+class ReservationSerializer(PeriodValidationMixin, serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = ['id', 'booking_person', 'date_from', 'date_to', 'booked_car']
@@ -25,3 +101,33 @@ class ReservationWithDetailsSerializer(serializers.ModelSerializer):
         model = Reservation
         fields = ['id', 'booking_person', 'date_from', 'date_to', 'booked_car']
         depth = 1
+
+
+class RecurringReservationSerializer(SparseFieldsMixin, IsoDateTimeMixin, serializers.ModelSerializer):
+    class Meta:
+        model = RecurringReservation
+        fields = ['id', 'booking_person', 'date_from', 'date_to', 'frequency', 'interval', 'weekdays', 'count',
+                  'until']
+
+    def validate_interval(self, value):
+        if value < 1:
+            raise serializers.ValidationError("Interval should be at least 1.")
+        return value
+
+    def validate_count(self, value):
+        if value is not None and not 1 <= value <= MAX_OCCURRENCES:
+            raise serializers.ValidationError(f"Count should be between 1 and {MAX_OCCURRENCES}.")
+        return value
+
+    def validate_weekdays(self, value):
+        weekdays = value.split(',') if value else []
+        if set(weekdays) - set('0123456'):
+            raise serializers.ValidationError("Weekdays should be comma separated numbers from 0 (Monday) to 6.")
+        return ','.join(sorted(set(weekdays)))
+
+    def validate(self, data):
+        if data.get('count') is None and data.get('until') is None:
+            raise serializers.ValidationError("Either count or until is required.")
+        if data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("Reservation ends earlier than starts.")
+        return data
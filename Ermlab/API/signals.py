@@ -0,0 +1,81 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Car, Reservation, Change, reservations_archived
+from .interval_index import reservation_index
+from .cache import bump_versions
+from .analytics import is_rollup_enabled, refresh_occupancy
+from . import changes
+from . import metrics
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidate_reservation_index(sender, instance, **kwargs):
+    reservation_index.invalidate(instance.booked_car_id)
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def invalidate_reservations_cache(sender, instance, **kwargs):
+    bump_versions('reservations', f'reservations:{instance.booked_car_id}')
+
+
+@receiver(pre_save, sender=Reservation)
+def remember_reservation_period(sender, instance, **kwargs):
+    # Days of the old period have to be refreshed as well when reservation is moved
+    if is_rollup_enabled() and instance.pk is not None:
+        instance._saved_period = Reservation.objects.filter(pk=instance.pk).values_list(
+            'booked_car', 'date_from', 'date_to').first()
+
+
+@receiver([post_save, post_delete], sender=Reservation)
+def refresh_occupancy_rollup(sender, instance, **kwargs):
+    if not is_rollup_enabled():
+        return
+    refresh_occupancy(instance.booked_car_id, instance.date_from, instance.date_to)
+    saved_period = getattr(instance, '_saved_period', None)
+    if saved_period is not None:
+        refresh_occupancy(*saved_period)
+
+
+@receiver([post_save, post_delete], sender=Car)
+def invalidate_car_cache(sender, instance, **kwargs):
+    # Details of reservations contain details of the car
+    bump_versions('cars', 'reservations', f'car:{instance.pk}', f'reservations:{instance.pk}')
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_save, sender=Reservation)
+def record_saved(sender, instance, **kwargs):
+    changes.record(Change.SAVE, [instance])
+
+
+@receiver(post_delete, sender=Car)
+@receiver(post_delete, sender=Reservation)
+def record_deleted(sender, instance, **kwargs):
+    changes.record(Change.DELETE, [instance])
+
+
+@receiver(reservations_archived)
+def record_archived(sender, reservations, **kwargs):
+    car_ids = set(reservations.values())
+    for car_id in car_ids:
+        reservation_index.invalidate(car_id)
+    bump_versions('reservations', *(f'reservations:{car_id}' for car_id in car_ids))
+    changes.record(Change.ARCHIVE, [Reservation(pk=pk, booked_car_id=car_id) for pk, car_id in reservations.items()])
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    # Wrapper stays on the connection object when it reconnects, so it's installed only once
+    if metrics.count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.count_query)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # Raw connection is used, so pragmas aren't counted as queries of current request
+    for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute(f'PRAGMA {pragma} = {value}')
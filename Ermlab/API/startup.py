@@ -0,0 +1,68 @@
+"""
+Probe started in a new process by `manage.py benchmark_startup`. It boots the WSGI application of
+DJANGO_SETTINGS_MODULE, serves one request of /api/cars without a server and prints JSON with
+monotonic clock of the first response, duration of the boot and resident memory
+"""
+import time
+
+started = time.monotonic()
+
+import json  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+from io import BytesIO  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PATH = '/api/cars'
+
+
+def get_max_rss_kb():
+    """
+    :return: Returns peak resident memory of the process in kilobytes, None if it can't be read
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def main():
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    booted = time.monotonic()
+    boot_rss_kb = get_max_rss_kb()
+
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': PATH, 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+        'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+    }
+    statuses = []
+    response = application(environ, lambda status, headers: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        response.close()
+    responded = time.monotonic()
+
+    print(json.dumps({
+        'settings': os.environ.get('DJANGO_SETTINGS_MODULE'),
+        'status': int(statuses[0].split()[0]),
+        'responded_at': responded,
+        'boot_ms': round((booted - started) * 1000, 1),
+        'request_ms': round((responded - booted) * 1000, 1),
+        'boot_rss_kb': boot_rss_kb,
+        'max_rss_kb': get_max_rss_kb(),
+        'modules': len(sys.modules),
+    }))
+
+
+if __name__ == '__main__':
+    main()
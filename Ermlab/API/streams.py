@@ -0,0 +1,90 @@
+"""
+Server-Sent Events streams served directly by the ASGI application, outside of Django views.
+Streaming responses of this version of Django are iterated synchronously, which would block the event loop
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from urllib.parse import parse_qs
+from .models import Change
+from .fast_serializers import format_datetime
+import asyncio
+import json
+
+CHANGES_PATH = '/api/changes/stream'
+
+
+def get_changes(since, limit):
+    try:
+        entries = Change.get_since(since, limit)
+    finally:
+        close_old_connections()
+    for entry in entries:
+        entry['created_at'] = format_datetime(entry['created_at'])
+    return entries
+
+
+async def change_stream(scope, receive, send):
+    """
+    Sends changes of cars and reservations as events, starting after change given by `since` query parameter
+    or by Last-Event-ID header of reconnecting client. The change log is polled every
+    CHANGE_STREAM_POLL_INTERVAL seconds, comment is sent every CHANGE_STREAM_KEEPALIVE seconds without changes
+    """
+
+    headers = dict(scope.get('headers', []))
+    query = parse_qs(scope.get('query_string', b'').decode())
+    try:
+        since = int(headers.get(b'last-event-id', b'') or query.get('since', ['0'])[0])
+    except ValueError:
+        await send({'type': 'http.response.start', 'status': 400,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': b"`since` should be a number"})
+        return
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    poll_interval = getattr(settings, 'CHANGE_STREAM_POLL_INTERVAL', 1)
+    keepalive = getattr(settings, 'CHANGE_STREAM_KEEPALIVE', 15)
+    fetch = sync_to_async(get_changes, thread_sensitive=False)
+    idle = 0
+    try:
+        while not disconnected.done():
+            entries = await fetch(since, 1000)
+            if entries:
+                since = entries[-1]['id']
+                body = ''.join(f"id: {entry['id']}\nevent: change\ndata: {json.dumps(entry)}\n\n"
+                               for entry in entries)
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+                idle = 0
+                continue
+
+            idle += poll_interval
+            if idle >= keepalive:
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                idle = 0
+            await asyncio.wait([disconnected], timeout=poll_interval)
+    finally:
+        disconnected.cancel()
+
+
+def with_streams(application):
+    """
+    Routes requests of streams to their ASGI applications and all others to given Django application
+    """
+
+    async def router(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == CHANGES_PATH:
+            if getattr(settings, 'CHANGE_STREAM_ENABLED', True):
+                return await change_stream(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return router
@@ -1,14 +1,96 @@
-from django.test import TestCase
-from rest_framework.test import APITestCase
+from django.test import TestCase, TransactionTestCase, AsyncClient, RequestFactory, override_settings
+from unittest import mock, skipIf
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+from django.core.management import call_command, CommandError
+from contextlib import contextmanager
+from io import StringIO
+from tempfile import TemporaryDirectory
+import os
+from rest_framework.test import APITestCase, APIClient
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+import asyncio
+import random
+import threading
+from itertools import accumulate
+import time
+import uuid
+import json
+import warnings
 from rest_framework import status
-from .models import Car, Reservation
+from .models import Car, Reservation, RecurringReservation, DailyOccupancy, ArchivedReservation, Change, \
+    MAX_OCCURRENCES
+from .interval_index import reservation_index
+from .renderers import FastJSONRenderer
+from .streams import change_stream
+from .cache import bump_versions, cached_response
+from .routers import ReplicaRouter, ReplicaMiddleware, STICKY_COOKIE, replica_database
+from .dates import parse_iso_datetime
+from . import async_views
+from . import metrics
+from . import analytics
+from . import availability
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 
 class CarListTest(APITestCase):
 
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+        Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                           date_of_next_technical_examination="2021-05-19")
+        Car.objects.create(brand='Opel', model="Corsa", registration_number="NO4321",
+                           date_of_next_technical_examination="2021-06-19")
+
     def test_car_list(self):
         response = self.client.get('/api/cars')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_car_list_pagination(self):
+        response = self.client.get('/api/cars?page_size=2')
+        self.assertEqual([car['registration_number'] for car in response.data['results']], ["NO9580", "NO1234"])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([car['registration_number'] for car in response.data['results']], ["NO4321"])
+        self.assertIsNone(response.data['next'])
+
+    def test_car_list_fields(self):
+        response = self.client.get('/api/cars?fields=id,brand')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'brand'})
+
+    def test_car_list_brand_filter(self):
+        response = self.client.get('/api/cars?brand=Opel')
+        self.assertEqual([car['model'] for car in response.data['results']], ["Astra", "Corsa"])
+
+    def test_available_cars(self):
+        Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00Z",
+                                   date_to="2021-01-20T00:00:00Z", booked_car=Car.objects.get(model="Corsa"))
+        response = self.client.get('/api/cars/available?from=2021-01-15T00:00:00Z&to=2021-04-01T00:00:00Z')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([car['model'] for car in response.data['results']], ["Octavia"])
+        response = self.client.get('/api/cars/available?from=2021-01-20T00:00:00Z&to=2021-01-25T00:00:00Z')
+        self.assertEqual([car['model'] for car in response.data['results']], ["Astra", "Octavia", "Corsa"])
+
+    def test_available_cars_without_offset(self):
+        # Dates without offset are in TIME_ZONE, so they can be compared with dates with offset
+        response = self.client.get('/api/cars/available?from=2021-01-15T00:00:00Z&to=2021-04-01T00:00:00')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([car['model'] for car in response.data['results']], ["Octavia", "Corsa"])
+        response = self.client.get('/api/cars/timeline?from=2021-01-15T00:00:00&to=2021-01-16T00:00:00')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_available_cars_with_wrong_period(self):
+        response = self.client.get('/api/cars/available?from=2021-01-15T00:00:00Z')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/cars/available?from=2021-01-15T00:00:00Z&to=2021-01-14T00:00:00Z')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
 class CarDetailsTest(APITestCase):
@@ -72,6 +154,39 @@ class ReservationListTest(APITestCase):
         response = self.client.get("/api/car/1/reservations")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_reservations_in_period(self):
+        response = self.client.get("/api/car/1/reservations?from=2021-01-19T00:00:00Z&to=2021-01-25T00:00:00Z"
+                                   "&fields=booking_person")
+        self.assertEqual(response.data['results'], [{'booking_person': "Marcin"}])
+        response = self.client.get("/api/car/1/reservations?from=2021-01-20T00:00:00Z")
+        self.assertEqual(response.data['results'], [])
+
+    def test_get_reservations_with_wrong_dates(self):
+        response = self.client.get("/api/car/1/reservations?from=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_reservation_with_iso_variants(self):
+        data = {
+            'booking_person': "Ewelina",
+            'date_from': "2021-01-21T03:00:00.250+01:00",
+            'date_to': "2021-01-23T00:00:00.5Z"
+        }
+        response = self.client.post("/api/car/1/reservations", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        reservation = Reservation.objects.get(booking_person="Ewelina")
+        self.assertEqual(reservation.date_from, datetime(2021, 1, 21, 2, 0, 0, 250000, tzinfo=timezone.utc))
+
+        response = self.client.post("/api/car/1/reservations", {**data, 'date_to': "soon"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date_to', response.data)
+
+    def test_parse_iso_datetime(self):
+        expected = datetime(2021, 1, 20, 10, tzinfo=timezone.utc)
+        for value in ("2021-01-20T10:00:00Z", "2021-01-20T10:00:00+0000", "2021-01-20 10:00:00.000+00:00",
+                      "2021-01-20T11:00+01"):
+            self.assertEqual(parse_iso_datetime(value), expected)
+        self.assertIsNone(parse_iso_datetime("2021-02-30T10:00:00Z"))
+
     def test_post_reservation(self):
         """
         tests putting reservation without collision with another reservation
@@ -121,6 +236,810 @@ class ReservationListTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class QueryBudgetTest(APITestCase):
+    """
+    Every endpoint has to stay within its maximal number of queries, no matter how many rows it returns
+    """
+
+    budgets = {
+        "/api/cars": 1,
+        "/api/cars/available?from=2021-01-01T00:00:00Z&to=2021-01-02T00:00:00Z": 1,
+        "/api/car/1": 1,
+        "/api/car/1/reservations": 2,
+        "/api/car/1/reservations/1": 1,
+        "/api/reservations": 1,
+    }
+
+    def setUp(self):
+        for number in range(5):
+            car = Car.objects.create(brand='Opel', model="Astra", registration_number=f"NO{number}",
+                                     date_of_next_technical_examination="2021-03-19")
+            for day in range(1, 11):
+                Reservation.objects.create(booking_person="Marcin", date_from=f"2021-01-{day:02}T03:00:00Z",
+                                           date_to=f"2021-01-{day:02}T05:00:00Z", booked_car=car)
+
+    @contextmanager
+    def assertMaxQueries(self, budget, url):
+        with CaptureQueriesContext(connection) as context:
+            yield
+        self.assertLessEqual(len(context.captured_queries), budget,
+                             f"{url} used {len(context.captured_queries)} queries, budget is {budget}")
+
+    def test_query_budgets(self):
+        for url, budget in self.budgets.items():
+            with self.assertMaxQueries(budget, url):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class FastSerializationTest(APITestCase):
+
+    urls = [
+        "/api/cars",
+        "/api/cars?fields=brand,date_of_next_technical_examination",
+        "/api/cars?page_size=1",
+        "/api/cars/available?from=2021-01-01T00:00:00Z&to=2021-01-02T00:00:00Z",
+        "/api/car/1/reservations",
+        "/api/car/1/reservations?fields=date_to",
+    ]
+
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+        Car.objects.create(brand='Škoda', model="Octavia \u2028", date_of_next_technical_examination="2021-03-19")
+        Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00.123456Z",
+                                   date_to="2021-01-20T00:00:00Z", booked_car=Car.objects.filter(pk=1)[0])
+        Reservation.objects.create(booking_person="Ewelina \"Ewa\"", date_from="2021-02-10T03:00:00Z",
+                                   date_to="2021-02-20T00:00:00Z", booked_car=Car.objects.filter(pk=1)[0])
+
+    def test_same_output(self):
+        for url in self.urls:
+            expected = self.client.get(url).content
+            with self.settings(FAST_SERIALIZATION_ENABLED=True):
+                self.assertEqual(self.client.get(url).content, expected, url)
+
+    def test_same_output_as_json_renderer(self):
+        response = self.client.get("/api/cars")
+        self.assertEqual(FastJSONRenderer().render(response.data), JSONRenderer().render(response.data))
+
+    def test_benchmark(self):
+        output = StringIO()
+        call_command('benchmark_serialization', rows=20, repeat=1, stdout=output)
+        self.assertIn("speedup", output.getvalue())
+        self.assertEqual(Car.objects.count(), 2)
+
+
+class CacheTest(APITestCase):
+
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+
+    def test_not_modified(self):
+        response = self.client.get("/api/car/1/reservations")
+        response = self.client.get("/api/car/1/reservations", HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_not_modified_since(self):
+        with mock.patch('API.cache.time') as clock:
+            clock.time.return_value = 1000.25
+            bump_versions('reservations:1')
+            response = self.client.get("/api/car/1/reservations")
+            self.assertFalse(response.has_header('Last-Modified'))
+            # Change in the same second gets the same date, so the date isn't trusted until the second ends
+            clock.time.return_value = 1000.75
+            bump_versions('reservations:1')
+            response = self.client.get("/api/car/1/reservations", HTTP_IF_MODIFIED_SINCE=http_date(1000))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            clock.time.return_value = 1001.5
+            response = self.client.get("/api/car/1/reservations")
+            self.assertEqual(response['Last-Modified'], http_date(1000))
+            response = self.client.get("/api/car/1/reservations", HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            bump_versions('reservations:1')
+            response = self.client.get("/api/car/1/reservations", HTTP_IF_MODIFIED_SINCE=http_date(1000))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cached_response(self):
+        self.client.get("/api/car/1")
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/car/1")
+        self.assertEqual(response.data['brand'], "Opel")
+
+    def test_invalidation(self):
+        response = self.client.get("/api/car/1/reservations")
+        etag = response['ETag']
+        self.assertEqual(response.data['results'], [])
+        data = {
+            'booking_person': "Ewelina",
+            'date_from': "2021-01-21T03:00:00Z",
+            'date_to': "2021-01-23T00:00:00Z"
+        }
+        self.client.post("/api/car/1/reservations", data)
+        response = self.client.get("/api/car/1/reservations", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class CacheCommitTest(TransactionTestCase):
+
+    def test_response_read_before_commit(self):
+        car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                 date_of_next_technical_examination="2021-03-19")
+        client = APIClient()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with transaction.atomic():
+                Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00Z",
+                                           date_to="2021-01-20T00:00:00Z", booked_car=car)
+                # Request of other connection caches data read before commit
+                response = executor.submit(client.get, f"/api/car/{car.pk}/reservations").result()
+                self.assertEqual(response.data['results'], [])
+            response = executor.submit(client.get, f"/api/car/{car.pk}/reservations").result()
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class IdempotencyTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+        self.data = {'booking_person': "Ewelina", 'date_from': "2021-01-21T03:00:00Z",
+                     'date_to': "2021-01-23T00:00:00Z"}
+        self.key = str(uuid.uuid4())
+
+    def test_retried_reservation(self):
+        response = self.client.post(f"/api/car/{self.car.pk}/reservations", self.data, format='json',
+                                    HTTP_IDEMPOTENCY_KEY=self.key)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(0):
+            retry = self.client.post(f"/api/car/{self.car.pk}/reservations", self.data, format='json',
+                                     HTTP_IDEMPOTENCY_KEY=self.key)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, response.data)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+        # The same key can't be used for different request
+        response = self.client.post(f"/api/car/{self.car.pk}/reservations", {**self.data, 'booking_person': "Maciej"},
+                                    format='json', HTTP_IDEMPOTENCY_KEY=self.key)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # Retry without key is validated again
+        response = self.client.post(f"/api/car/{self.car.pk}/reservations", self.data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=1)
+    def test_retry_after_killed_request(self):
+        url = f"/api/car/{self.car.pk}/reservations"
+        # Worker is killed before the response is stored, its key stays locked
+        with mock.patch.object(Car, 'lock_for_booking', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                self.client.post(url, self.data, format='json', HTTP_IDEMPOTENCY_KEY=self.key)
+        response = self.client.post(url, self.data, format='json', HTTP_IDEMPOTENCY_KEY=self.key)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        time.sleep(1.1)
+        response = self.client.post(url, self.data, format='json', HTTP_IDEMPOTENCY_KEY=self.key)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_retried_update(self):
+        responses = [self.client.patch(f"/api/car/{self.car.pk}", {'model': "Corsa"}, format='json',
+                                       HTTP_IDEMPOTENCY_KEY=self.key) for _ in range(2)]
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertFalse(responses[0].has_header('Idempotent-Replayed'))
+        self.assertTrue(responses[1].has_header('Idempotent-Replayed'))
+
+
+class ChangeLogTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+        self.since = Change.objects.order_by('id').values_list('id', flat=True).first() - 1
+
+    def test_changes(self):
+        data = {'booking_person': "Ewelina", 'date_from': "2021-01-21T03:00:00Z", 'date_to': "2021-01-23T00:00:00Z"}
+        self.client.post(f"/api/car/{self.car.pk}/reservations", data, format='json')
+        reservation = Reservation.objects.get()
+        self.client.delete(f"/api/car/{self.car.pk}/reservations/{reservation.pk}")
+
+        response = self.client.get(f"/api/changes?since={self.since}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([(change['model'], change['op']) for change in results],
+                         [('car', 'save'), ('reservation', 'save'), ('reservation', 'delete')])
+        self.assertEqual(results[0]['payload']['brand'], "Opel")
+        self.assertEqual(results[1]['payload']['booked_car'], self.car.pk)
+        self.assertEqual(results[2]['payload'], {'id': reservation.pk})
+        self.assertFalse(response.data['more'])
+
+        response = self.client.get(f"/api/changes?since={response.data['last']}")
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get("/api/changes?since=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_changes_of_bulk_writes(self):
+        data = [{"brand": "Toyota", "model": model, "date_of_next_technical_examination": "2022-01-04"}
+                for model in ("Avensis", "Yaris")]
+        self.client.post("/api/cars/bulk", data, format='json')
+        first_page = self.client.get(f"/api/changes?since={self.since + 1}&limit=1").data
+        self.assertTrue(first_page['more'])
+        second_page = self.client.get(f"/api/changes?since={first_page['last']}").data
+        self.assertEqual([change['object_id'] for change in first_page['results'] + second_page['results']],
+                         list(Car.objects.filter(brand="Toyota").order_by('pk').values_list('pk', flat=True)))
+
+    def test_changes_after_gap(self):
+        gap = Change.objects.create(model='car', object_id=self.car.pk, op=Change.SAVE, payload={}).id
+        Change.objects.create(model='car', object_id=self.car.pk, op=Change.SAVE, payload={})
+        # Change of a transaction which isn't committed yet
+        Change.objects.filter(id=gap).delete()
+
+        response = self.client.get(f"/api/changes?since={self.since}")
+        self.assertEqual(len(response.data['results']), 1)
+        with self.settings(CHANGE_LOG_LAG=0):
+            response = self.client.get(f"/api/changes?since={self.since}")
+        self.assertEqual([change['id'] for change in response.data['results']], [self.since + 1, gap + 1])
+
+    def test_prune_changes(self):
+        Change.objects.update(created_at=datetime(2021, 1, 1, tzinfo=timezone.utc))
+        Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                           date_of_next_technical_examination="2021-03-19")
+        output = StringIO()
+        call_command('prune_changes', batch_size=1, stdout=output)
+        self.assertIn("Deleted 1 changes", output.getvalue())
+        self.assertEqual(list(Change.objects.values_list('model', 'object_id')),
+                         [('car', Car.objects.get(brand='Skoda').pk)])
+
+        # Cutoff without offset is taken in the current time zone
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            call_command('prune_changes', before="2021-01-02T00:00:00", stdout=output)
+        with self.assertRaises(CommandError):
+            call_command('prune_changes', before="2021-02-30T00:00:00Z", stdout=output)
+
+
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+
+    def get_metric(self, name):
+        lines = self.client.get("/metrics").content.decode().splitlines()
+        values = [float(line.split()[-1]) for line in lines if line.startswith(name)]
+        return values[0] if values else 0
+
+    def test_metrics(self):
+        name = 'api_request_db_queries_sum{route="api/car/<int:pk>/reservations",method="GET"}'
+        queries = self.get_metric(name)
+        hits = self.get_metric('api_response_cache_total{result="hit"}')
+        self.client.get("/api/car/1/reservations")
+        self.client.get("/api/car/1/reservations")
+        self.assertGreaterEqual(self.get_metric(name), queries + 2)
+        self.assertEqual(self.get_metric('api_response_cache_total{result="hit"}'), hits + 1)
+        self.assertGreater(self.get_metric('api_request_serialization_duration_seconds_count{route="api/car/<int:pk>/'
+                                           'reservations",method="GET"}'), 0)
+
+    def test_profiling(self):
+        with TemporaryDirectory() as directory:
+            with self.settings(PROFILE_EVERY_N_REQUESTS=1, PROFILE_DIR=directory):
+                self.client.get("/api/car/1")
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+
+class BulkTest(APITestCase):
+
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+        Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                           date_of_next_technical_examination="2021-03-19")
+        Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00Z",
+                                   date_to="2021-01-20T00:00:00Z", booked_car=Car.objects.filter(pk=1)[0])
+
+    def test_post_cars(self):
+        data = [
+            {"brand": "Toyota", "model": "Avensis", "registration_number": "NO7845",
+             "date_of_next_technical_examination": "2022-01-04"},
+            {"brand": "Toyota", "model": "Yaris", "registration_number": "NO7845",
+             "date_of_next_technical_examination": "2022-01-04"},
+            {"brand": "Toyota", "model": "Corolla", "registration_number": "NO9580",
+             "date_of_next_technical_examination": "2022-01-04"},
+            {"brand": "Toyota", "model": "Auris"},
+        ]
+        response = self.client.post("/api/cars/bulk", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data], [201, 400, 400, 400])
+        self.assertEqual(Car.objects.count(), 3)
+        self.assertEqual(response.data[0]['data']['id'], Car.objects.get(registration_number="NO7845").pk)
+
+    def test_post_reservations(self):
+        data = [
+            {'booking_person': "Ewelina", 'date_from': "2021-01-11T03:00:00Z", 'date_to': "2021-01-23T00:00:00Z"},
+            {'booking_person': "Ewelina", 'date_from': "2021-01-25T03:00:00Z", 'date_to': "2021-01-28T00:00:00Z"},
+            {'booking_person': "Maciej", 'date_from': "2021-01-21T03:00:00Z", 'date_to': "2021-01-26T00:00:00Z"},
+            {'booking_person': "Maciej", 'date_from': "2021-02-24T03:00:00Z", 'date_to': "2021-03-23T00:00:00Z"},
+            {'booking_person': "Maciej", 'date_from': "yesterday", 'date_to': "2021-03-23T00:00:00Z"},
+        ]
+        response = self.client.post("/api/car/1/reservations/bulk", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data], [405, 405, 201, 405, 400])
+        self.assertEqual(Reservation.objects.filter(booked_car=1).count(), 2)
+        self.assertEqual(response.data[2]['data']['id'], Reservation.objects.get(booking_person="Maciej").pk)
+
+    def test_post_reservations_of_many_cars(self):
+        data = [
+            {'booking_person': "Ewelina", 'date_from': "2021-01-11T03:00:00Z", 'date_to': "2021-01-23T00:00:00Z",
+             'booked_car': 1},
+            {'booking_person': "Ewelina", 'date_from': "2021-01-11T03:00:00Z", 'date_to': "2021-01-23T00:00:00Z",
+             'booked_car': 2},
+            {'booking_person': "Ewelina", 'date_from': "2021-01-11T03:00:00Z", 'date_to': "2021-01-23T00:00:00Z",
+             'booked_car': 3},
+            {'booking_person': "Ewelina", 'date_from': "2021-01-11T03:00:00Z", 'date_to': "2021-01-23T00:00:00Z"},
+        ]
+        response = self.client.post("/api/reservations/bulk", data, format='json')
+        self.assertEqual([result['status'] for result in response.data], [405, 201, 404, 400])
+        self.assertEqual(Reservation.objects.filter(booked_car=2).count(), 1)
+
+
+class RecurringReservationTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+        Reservation.objects.create(booking_person="Marcin", date_from="2021-01-30T10:00:00Z",
+                                   date_to="2021-01-30T12:00:00Z", booked_car=self.car)
+        self.rule = {'booking_person': "Ewelina", 'date_from': "2021-01-04T08:00:00Z",
+                     'date_to': "2021-01-04T17:00:00Z", 'frequency': 'daily', 'weekdays': "0,1,2,3,4", 'count': 10}
+
+    def test_occurrences(self):
+        start = datetime(2021, 1, 4, 8, tzinfo=timezone.utc)
+        rule = RecurringReservation(date_from=start, date_to=start + timedelta(hours=9), frequency='daily',
+                                    weekdays="0,1,2,3,4", count=10)
+        self.assertEqual([date_from.day for date_from, _ in rule.get_occurrences()],
+                         [4, 5, 6, 7, 8, 11, 12, 13, 14, 15])
+        self.assertEqual([date_from.day for date_from, _ in rule.get_occurrences(start + timedelta(days=6),
+                                                                                start + timedelta(days=9))],
+                         [11, 12])
+        rule = RecurringReservation(date_from=start, date_to=start + timedelta(hours=9), frequency='weekly',
+                                    interval=2, weekdays="0,3", until=start + timedelta(days=28))
+        self.assertEqual([date_from.day for date_from, _ in rule.get_occurrences()], [4, 7, 18, 21, 1])
+        # Dates without offset are in TIME_ZONE
+        self.assertEqual([date_from.day for date_from, _ in rule.get_occurrences(datetime(2021, 1, 10),
+                                                                                datetime(2021, 1, 20))], [18])
+
+    def test_post_recurring_reservation(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f"/api/car/{self.car.pk}/recurring-reservations", self.rule, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['occurrences'], 10)
+        self.assertLess(len(context.captured_queries), 10)
+        self.assertEqual(Reservation.objects.filter(recurring_reservation=response.data['id']).count(), 10)
+
+        # Occurrences are respected by single reservations
+        response = self.client.post(f"/api/car/{self.car.pk}/reservations",
+                                    {'booking_person': "Maciej", 'date_from': "2021-01-12T16:00:00+0000",
+                                     'date_to': "2021-01-12T18:00:00+0000"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_post_longest_recurring_reservation(self):
+        car = Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                                 date_of_next_technical_examination="2030-01-01")
+        self.rule.update(weekdays="", count=None, until="2023-09-30T08:00:00Z")
+        response = self.client.post(f"/api/car/{car.pk}/recurring-reservations", self.rule, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['occurrences'], MAX_OCCURRENCES)
+
+        self.rule.update(date_from="2023-10-01T08:00:00Z", date_to="2023-10-01T17:00:00Z",
+                         until="2026-06-27T08:00:00Z")
+        response = self.client.post(f"/api/car/{car.pk}/recurring-reservations", self.rule, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_colliding_recurring_reservation(self):
+        self.rule.update(weekdays="", count=30)
+        response = self.client.post(f"/api/car/{self.car.pk}/recurring-reservations", self.rule, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(response.data['colliding'],
+                         [{'date_from': "2021-01-30T08:00:00Z", 'date_to': "2021-01-30T17:00:00Z"}])
+
+        # Occurrences longer than interval collide with each other
+        self.rule.update(date_to="2021-01-05T09:00:00Z", count=3)
+        response = self.client.post(f"/api/car/{self.car.pk}/recurring-reservations", self.rule, format='json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(RecurringReservation.objects.count(), 0)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_post_wrong_recurring_reservation(self):
+        for wrong in ({'count': None}, {'weekdays': "1,7"}, {'interval': 0}, {'frequency': 'monthly'}):
+            response = self.client.post(f"/api/car/{self.car.pk}/recurring-reservations", {**self.rule, **wrong},
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_and_delete_recurring_reservation(self):
+        pk = self.client.post(f"/api/car/{self.car.pk}/recurring-reservations", self.rule, format='json').data['id']
+        response = self.client.get(f"/api/car/{self.car.pk}/recurring-reservations/{pk}"
+                                   "?from=2021-01-08T00:00:00Z&to=2021-01-12T00:00:00Z")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([occurrence['date_from'] for occurrence in response.data['occurrences']],
+                         ["2021-01-08T08:00:00Z", "2021-01-11T08:00:00Z"])
+        response = self.client.get(f"/api/car/{self.car.pk}/recurring-reservations/{pk}"
+                                   "?from=2021-01-08T00:00:00&to=2021-01-12T00:00:00")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['occurrences']), 2)
+        response = self.client.get(f"/api/car/{self.car.pk}/recurring-reservations")
+        self.assertEqual(len(response.data['results']), 1)
+
+        response = self.client.delete(f"/api/car/{self.car.pk}/recurring-reservations/{pk}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+
+class UtilizationTest(APITestCase):
+
+    def setUp(self):
+        self.opel = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                       date_of_next_technical_examination="2021-03-19")
+        self.other_opel = Car.objects.create(brand='Opel', model="Corsa", registration_number="NO1234",
+                                             date_of_next_technical_examination="2021-03-19")
+        self.skoda = Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO4321",
+                                        date_of_next_technical_examination="2021-03-19")
+        self.period = (datetime(2021, 1, 4, tzinfo=timezone.utc), datetime(2021, 1, 11, tzinfo=timezone.utc))
+
+    def create_reservations(self):
+        Reservation.objects.create(booking_person="Marcin", date_from="2021-01-04T12:00:00Z",
+                                   date_to="2021-01-06T00:00:00Z", booked_car=self.opel)
+        Reservation.objects.create(booking_person="Ewelina", date_from="2021-01-01T00:00:00Z",
+                                   date_to="2021-01-05T00:00:00Z", booked_car=self.other_opel)
+
+    def test_utilization_of_cars(self):
+        self.create_reservations()
+        with self.assertNumQueries(1):
+            results = analytics.get_utilization(*self.period)
+        self.assertEqual([(result['car'], result['booked_hours'], result['available_hours']) for result in results],
+                         [(self.opel.pk, 36, 168), (self.other_opel.pk, 24, 168), (self.skoda.pk, 0, 168)])
+
+    def test_utilization_of_brands_by_day(self):
+        self.create_reservations()
+        response = self.client.get("/api/analytics/utilization?from=2021-01-04T00:00:00Z&to=2021-01-11T00:00:00Z"
+                                   "&group_by=brand&bucket=day")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 14)
+        self.assertEqual(results[0], {'brand': 'Opel', 'bucket': date(2021, 1, 4), 'booked_hours': 36,
+                                      'available_hours': 48, 'utilization': 0.75})
+        self.assertEqual(results[1]['booked_hours'], 24)
+        self.assertEqual(sum(result['booked_hours'] for result in results[7:]), 0)
+
+    def test_utilization_follows_cars(self):
+        self.create_reservations()
+        url = "/api/analytics/utilization?from=2021-01-04T00:00:00Z&to=2021-01-11T00:00:00Z&group_by=brand"
+        self.assertEqual([result['brand'] for result in self.client.get(url).data['results']], ['Opel', 'Skoda'])
+        # Update doesn't send signals, changed brand is announced only by version of cars
+        Car.objects.filter(pk=self.other_opel.pk).update(brand='Skoda')
+        bump_versions('cars')
+        results = self.client.get(url).data['results']
+        self.assertEqual([(result['brand'], result['booked_hours']) for result in results],
+                         [('Opel', 36), ('Skoda', 24)])
+
+    def test_wrong_parameters(self):
+        for query in ("", "?from=2021-01-04T00:00:00Z",
+                      "?from=2021-01-04T00:00:00Z&to=2021-01-11T00:00:00Z&bucket=hour",
+                      "?from=2021-01-04T00:00:00Z&to=2021-01-11T00:00:00Z&group_by=model",
+                      "?from=2020-01-04T00:00:00Z&to=2022-01-11T00:00:00Z&bucket=day"):
+            response = self.client.get(f"/api/analytics/utilization{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(OCCUPANCY_ROLLUP_ENABLED=True)
+    def test_rollup(self):
+        self.create_reservations()
+        self.assertEqual(DailyOccupancy.objects.count(), 6)
+        for group_by in analytics.GROUPS:
+            for bucket in (None, ) + analytics.BUCKETS:
+                with self.settings(OCCUPANCY_ROLLUP_ENABLED=False):
+                    expected = analytics.get_utilization(*self.period, group_by, bucket)
+                self.assertEqual(analytics.get_utilization(*self.period, group_by, bucket), expected)
+
+        # Rollup follows moved and deleted reservations
+        reservation = Reservation.objects.get(booked_car=self.opel)
+        reservation.date_from = datetime(2021, 1, 8, tzinfo=timezone.utc)
+        reservation.date_to = datetime(2021, 1, 8, 6, tzinfo=timezone.utc)
+        reservation.save()
+        self.assertEqual(list(DailyOccupancy.objects.filter(car=self.opel).values_list('day', 'booked')),
+                         [(date(2021, 1, 8), timedelta(hours=6))])
+        reservation.delete()
+        self.assertFalse(DailyOccupancy.objects.filter(car=self.opel).exists())
+
+        call_command('rebuild_occupancy', stdout=StringIO())
+        self.assertEqual(DailyOccupancy.objects.count(), 4)
+
+
+class TimelineTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-01-20")
+        self.other_car = Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                                            date_of_next_technical_examination="2021-03-19")
+        for date_from, date_to in (("2021-01-05", "2021-01-07"), ("2021-01-06", "2021-01-08"),
+                                   ("2021-01-08", "2021-01-09"), ("2021-01-12", "2021-01-13")):
+            Reservation.objects.create(booking_person="Marcin", date_from=f"{date_from}T00:00:00Z",
+                                       date_to=f"{date_to}T00:00:00Z", booked_car=self.car)
+        self.period = "from=2021-01-01T00:00:00Z&to=2021-01-31T00:00:00Z"
+
+    def test_get_timeline(self):
+        response = self.client.get(f"/api/car/{self.car.pk}/timeline?{self.period}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(period['date_from'][:10], period['date_to'][:10]) for period in response.data['busy']],
+                         [("2021-01-05", "2021-01-09"), ("2021-01-12", "2021-01-13")])
+        # Car is free until the end of the day of its technical examination
+        self.assertEqual([(period['date_from'][:10], period['date_to'][:10]) for period in response.data['free']],
+                         [("2021-01-01", "2021-01-05"), ("2021-01-09", "2021-01-12"), ("2021-01-13", "2021-01-21")])
+
+        response = self.client.get(f"/api/car/{self.car.pk}/timeline?from=2021-01-06T00:00:00Z")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_timelines_follow_cars(self):
+        url = f"/api/cars/timeline?{self.period}&brand=Opel"
+        car_url = f"/api/car/{self.car.pk}/timeline?{self.period}"
+        self.assertEqual([timeline['car'] for timeline in self.client.get(url).data['results']], [self.car.pk])
+        self.assertEqual(self.client.get(car_url).data['free'][-1]['date_to'][:10], "2021-01-21")
+        # Update doesn't send signals, changed cars are announced only by versions of cars
+        Car.objects.filter(pk=self.other_car.pk).update(brand='Opel')
+        Car.objects.filter(pk=self.car.pk).update(date_of_next_technical_examination="2021-01-15")
+        bump_versions('cars', f'car:{self.car.pk}')
+        self.assertEqual([timeline['car'] for timeline in self.client.get(url).data['results']],
+                         [self.car.pk, self.other_car.pk])
+        self.assertEqual(self.client.get(car_url).data['free'][-1]['date_to'][:10], "2021-01-16")
+
+    def test_get_timelines_of_many_cars(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/cars/timeline?{self.period}&ids={self.car.pk},{self.other_car.pk}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([timeline['car'] for timeline in response.data['results']],
+                         [self.car.pk, self.other_car.pk])
+        self.assertEqual(response.data['results'][1]['busy'], [])
+        self.assertEqual(response.data['results'][1]['free'],
+                         [{'date_from': "2021-01-01T00:00:00Z", 'date_to': "2021-01-31T00:00:00Z"}])
+
+        response = self.client.get(f"/api/cars/timeline?{self.period}&brand=Skoda")
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ArchiveTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+        self.old_pks = [Reservation.objects.create(booking_person="Marcin", date_from=f"2020-0{month}-01T00:00:00Z",
+                                                   date_to=f"2020-0{month}-02T00:00:00Z", booked_car=self.car).pk
+                        for month in range(1, 4)]
+        Reservation.objects.create(booking_person="Ewelina", date_from="2021-01-10T03:00:00Z",
+                                   date_to="2021-01-20T00:00:00Z", booked_car=self.car)
+
+    def test_archive_reservations(self):
+        output = StringIO()
+        call_command('archive_reservations', before="2021-01-01T00:00:00Z", batch_size=2, stdout=output)
+        self.assertIn("Archived 3 reservations", output.getvalue())
+        self.assertEqual(Reservation.objects.count(), 1)
+        self.assertEqual(sorted(ArchivedReservation.objects.values_list('pk', flat=True)), self.old_pks)
+
+        response = self.client.get(f"/api/car/{self.car.pk}/reservations")
+        self.assertEqual(len(response.data['results']), 1)
+        response = self.client.get(f"/api/car/{self.car.pk}/reservations?include_archived=true")
+        self.assertEqual([reservation['id'] for reservation in response.data['results']][:3], self.old_pks)
+        response = self.client.get("/api/reservations?include_archived=1")
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(response.data['results'][0]['booked_car']['brand'], 'Opel')
+
+        # Archived reservations don't take part in collision checks anymore
+        self.assertTrue(Reservation.is_period_valid(Car.objects.get(pk=self.car.pk), "2020-01-01T00:00:00+0000",
+                                                    "2020-01-01T12:00:00+0000"))
+
+    def test_archive_announces_changes(self):
+        url = f"/api/car/{self.car.pk}/reservations"
+        self.assertEqual(len(self.client.get(url).data['results']), 4)
+        with transaction.atomic():
+            archived = ArchivedReservation.archive(datetime(2021, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(archived, {pk: self.car.pk for pk in self.old_pks})
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+        self.assertEqual(sorted(Change.objects.filter(op=Change.ARCHIVE).values_list('object_id', flat=True)),
+                         self.old_pks)
+
+    def test_archive_cutoff(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_reservations', before="2021-13-01T00:00:00Z", stdout=StringIO())
+        # Cutoff without offset is taken in the current time zone, not compared as naive datetime
+        output = StringIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            call_command('archive_reservations', before="2021-01-01T00:00:00", stdout=output)
+        self.assertIn("Archived 3 reservations which ended before 2021-01-01T00:00:00+00:00", output.getvalue())
+
+    @override_settings(OCCUPANCY_ROLLUP_ENABLED=True)
+    def test_archive_keeps_occupancy(self):
+        call_command('rebuild_occupancy', stdout=StringIO())
+        period = (datetime(2020, 1, 1, tzinfo=timezone.utc), datetime(2021, 2, 1, tzinfo=timezone.utc))
+        occupancy = list(DailyOccupancy.objects.order_by('day').values_list('day', 'booked'))
+        utilization = analytics.get_utilization(*period)
+        self.assertEqual(len(occupancy), 13)
+
+        call_command('archive_reservations', before="2021-01-01T00:00:00Z", stdout=StringIO())
+        self.assertEqual(list(DailyOccupancy.objects.order_by('day').values_list('day', 'booked')), occupancy)
+        self.assertEqual(analytics.get_utilization(*period), utilization)
+        with self.settings(OCCUPANCY_ROLLUP_ENABLED=False):
+            self.assertEqual(analytics.get_utilization(*period), utilization)
+
+        call_command('rebuild_occupancy', stdout=StringIO())
+        self.assertEqual(list(DailyOccupancy.objects.order_by('day').values_list('day', 'booked')), occupancy)
+
+
+class ExaminationTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+        self.other_car = Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                                            date_of_next_technical_examination="2021-06-01")
+        self.reservations = [
+            Reservation.objects.create(booking_person="Marcin", date_from=f"2021-0{month}-10T03:00:00Z",
+                                       date_to=f"2021-0{month}-12T00:00:00Z", booked_car=car)
+            for car in (self.car, self.other_car) for month in (2, 3, 4)]
+        self.after = "after=2021-01-01T00:00:00Z"
+
+    def test_get_conflicts(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/cars/examinations/conflicts?{self.after}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(reservation['id'], reservation['booked_car']['id'])
+                          for reservation in response.data['results']], [(self.reservations[2].pk, self.car.pk)])
+
+        response = self.client.get(f"/api/cars/examinations/conflicts?{self.after}&before=2021-03-01")
+        self.assertEqual(response.data['results'], [])
+        for query in ("before=soon", "before=2021-02-30", "after=2021-02-30T00:00:00Z"):
+            response = self.client.get(f"/api/cars/examinations/conflicts?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_conflicts_of_now_are_not_cached(self):
+        ends = datetime.now(timezone.utc) + timedelta(days=10)
+        reservation = Reservation.objects.create(booking_person="Ewelina", date_from=ends - timedelta(days=2),
+                                                 date_to=ends, booked_car=self.car)
+        url = "/api/cars/examinations/conflicts?before=2021-04-01"
+        self.assertEqual([conflict['id'] for conflict in self.client.get(url).data['results']], [reservation.pk])
+        # Time passes, the reservation has ended by now without any write
+        Reservation.objects.filter(pk=reservation.pk).update(date_from=ends - timedelta(days=30),
+                                                             date_to=ends - timedelta(days=20))
+        self.assertEqual(self.client.get(url).data['results'], [])
+
+    def test_update_examinations(self):
+        data = [{'id': self.car.pk, 'date_of_next_technical_examination': "2021-05-01"},
+                {'id': self.other_car.pk, 'date_of_next_technical_examination': "2021-03-11"},
+                {'id': 0, 'date_of_next_technical_examination': "2021-03-11"}]
+        response = self.client.post(f"/api/cars/examinations?{self.after}", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], [self.car.pk, self.other_car.pk])
+        self.assertEqual(response.data['not_found'], [0])
+        self.assertEqual([reservation['id'] for reservation in response.data['impacted_reservations']],
+                         [reservation.pk for reservation in self.reservations[4:]])
+        self.assertEqual(str(Car.objects.get(pk=self.car.pk).date_of_next_technical_examination), "2021-05-01")
+
+        for wrong in ([{'id': self.car.pk}], [{'id': self.car.pk, 'date_of_next_technical_examination': "2021-02-30"}]):
+            response = self.client.post("/api/cars/examinations", wrong, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        with TemporaryDirectory() as directory:
+            updates = os.path.join(directory, 'updates.csv')
+            with open(updates, 'w') as file:
+                file.write(f"{self.other_car.pk},2021-02-01\n")
+            output = StringIO()
+            call_command('examination_conflicts', after="2021-01-01T00:00:00Z", updates=updates, stdout=output,
+                         stderr=StringIO())
+        conflicts = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([conflict['id'] for conflict in conflicts],
+                         [self.reservations[2].pk] + [reservation.pk for reservation in self.reservations[3:]])
+        self.assertEqual(conflicts[-1]['date_of_next_technical_examination'], "2021-02-01")
+
+        # Date without offset is taken in the current time zone
+        output = StringIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            call_command('examination_conflicts', after="2021-01-01T00:00:00", stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), len(conflicts))
+
+
+class AvailabilityCheckTest(APITestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-01-25")
+        self.other_car = Car.objects.create(brand='Skoda', model="Octavia", registration_number="NO1234",
+                                            date_of_next_technical_examination="2021-03-19")
+        for car, date_from, date_to in ((self.car, "2021-01-05", "2021-01-07"), (self.car, "2021-01-06", "2021-01-10"),
+                                        (self.other_car, "2021-01-12", "2021-01-13")):
+            Reservation.objects.create(booking_person="Marcin", date_from=f"{date_from}T00:00:00Z",
+                                       date_to=f"{date_to}T00:00:00Z", booked_car=car)
+        self.windows = [{'date_from': f"2021-01-{day_from:02}T00:00:00Z", 'date_to': f"2021-01-{day_to:02}T00:00:00Z"}
+                        for day_from, day_to in ((1, 5), (8, 9), (10, 12), (12, 14), (24, 26), (3, 2))]
+
+    def test_check(self):
+        data = {'cars': [self.car.pk, self.other_car.pk, 0], 'windows': self.windows}
+        with self.assertNumQueries(2):
+            response = self.client.post("/api/availability/check", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['available'], [[True, False, True, True, False, False],
+                                                      [True, True, True, False, True, False],
+                                                      [False] * 6])
+        self.assertEqual(response.data['not_found'], [0])
+
+        # Every cell follows rules of is_period_valid
+        cars = Car.objects.in_bulk()
+        for car_id, row in zip(data['cars'], response.data['available']):
+            for window, available in zip(self.windows, row):
+                if car_id in cars:
+                    self.assertEqual(Reservation.is_period_valid(cars[car_id], window['date_from'],
+                                                                 window['date_to']), available)
+
+    def test_examination_day_in_offset_of_window(self):
+        # Both windows end on 2021-01-25 23:30 UTC, the first one already on the 26th in its own offset
+        windows = [{'date_from': "2021-01-25T20:00:00+01:00", 'date_to': "2021-01-26T00:30:00+01:00"},
+                   {'date_from': "2021-01-25T14:00:00-05:00", 'date_to': "2021-01-25T18:30:00-05:00"}]
+        response = self.client.post("/api/availability/check", {'cars': [self.car.pk], 'windows': windows},
+                                    format='json')
+        self.assertEqual(response.data['available'], [[False, True]])
+        car = Car.objects.get(pk=self.car.pk)
+        for window, available in zip(windows, response.data['available'][0]):
+            self.assertEqual(Reservation.is_period_valid(car, window['date_from'], window['date_to']), available)
+
+    def test_wrong_request(self):
+        for data in ({'cars': [self.car.pk]}, {'cars': ["1"], 'windows': []},
+                     {'cars': [self.car.pk], 'windows': [{'date_from': "soon"}]}):
+            response = self.client.post("/api/availability/check", data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipIf(availability.get_numpy() is None, "numpy isn't installed")
+    def test_numpy_sweep(self):
+        rand = random.Random(0)
+        starts = sorted(rand.randrange(1000) for _ in range(50))
+        latest_ends = list(accumulate((start + rand.randrange(1, 30) for start in starts), max))
+        window_froms = [rand.randrange(1000) for _ in range(200)]
+        window_tos = [window_from + rand.randrange(1, 30) for window_from in window_froms]
+        numpy = availability.get_numpy()
+        self.assertEqual(availability.get_free_with_numpy(starts, latest_ends, numpy.array(window_froms),
+                                                          numpy.array(window_tos)),
+                         availability.get_free_with_bisect(starts, latest_ends, window_froms, window_tos))
+
+
+class ReservationExportTest(APITestCase):
+
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+        Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00Z",
+                                   date_to="2021-01-20T00:00:00Z", booked_car=Car.objects.filter(pk=1)[0])
+        Reservation.objects.create(booking_person="Ewelina", date_from="2021-02-10T03:00:00Z",
+                                   date_to="2021-02-20T00:00:00Z", booked_car=Car.objects.filter(pk=1)[0])
+
+    def test_export_ndjson(self):
+        response = self.client.get("/api/reservations/export?from=2021-02-01T00:00:00Z")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ['{"id": 2, "booking_person": "Ewelina", "date_from": "2021-02-10T03:00:00Z", '
+                                 '"date_to": "2021-02-20T00:00:00Z", "booked_car": 1}'])
+
+    def test_export_csv(self):
+        response = self.client.get("/api/reservations/export?output=csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,booking_person,date_from,date_to,booked_car")
+        self.assertEqual(lines[1], "1,Marcin,2021-01-10T03:00:00Z,2021-01-20T00:00:00Z,1")
+        self.assertEqual(len(lines), 3)
+
+
 class ReservationDetailsTest(APITestCase):
 
     def setUp(self):
@@ -160,6 +1079,22 @@ class ReservationDetailsTest(APITestCase):
         response = self.client.delete("/api/car/1/reservations/1")
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_reservation_of_other_car(self):
+        other_car = Car.objects.create(brand='Fiat', model="Punto", registration_number="WA1234",
+                                       date_of_next_technical_examination="2021-03-19")
+        Reservation.objects.create(booking_person="Anna", date_from="2021-01-25T00:00:00Z",
+                                   date_to="2021-01-26T00:00:00Z", booked_car=other_car)
+        data = {"booking_person": "Maciej", "date_from": "2021-01-10T00:00:00Z", "date_to": "2021-01-11T00:00:00Z"}
+
+        # Reservation 1 belongs to car 1, so it can't be changed through other car
+        response = self.client.put(f"/api/car/{other_car.pk}/reservations/1", data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.patch(f"/api/car/{other_car.pk}/reservations/1", data)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.delete(f"/api/car/{other_car.pk}/reservations/1")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Reservation.objects.get(pk=1).date_from, datetime(2021, 1, 10, 3, tzinfo=timezone.utc))
+
 
 class ReservationMethodTest(TestCase):
 
@@ -191,4 +1126,346 @@ class ReservationMethodTest(TestCase):
                                                      date_to="2021-01-22T00:00:00Z",
                                                      booked_car=Car.objects.filter(pk=1)[0])
         self.assertEqual(new_reservation.is_period_valid(car, new_reservation.date_from, new_reservation.date_to),
-                         False)
\ No newline at end of file
+                         False)
+
+    def test_reservation_adjacent_to_another(self):
+        car = Car.objects.get(brand="Opel")
+        self.assertEqual(Reservation.is_period_valid(car, "2021-01-20T00:00:00+0000", "2021-01-22T00:00:00+0000"),
+                         True)
+
+    def test_reservation_to_miss(self):
+        car = Car.objects.get(brand="Opel")
+        reservation = Reservation.objects.get(booking_person="Marcin")
+        self.assertEqual(Reservation.is_period_valid(car, "2021-01-12T00:00:00+0000", "2021-01-22T00:00:00+0000",
+                                                     reservation), True)
+
+
+@override_settings(RESERVATION_INDEX_ENABLED=True)
+class ReservationIndexTest(TestCase):
+
+    def setUp(self):
+        reservation_index.invalidate()
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+        self.car = Car.objects.get(brand="Opel")
+        self.reservation = Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00Z",
+                                                      date_to="2021-01-20T00:00:00Z", booked_car=self.car)
+
+    def test_collision_without_query(self):
+        Reservation.is_period_valid(self.car, "2021-01-21T00:00:00+0000", "2021-01-22T00:00:00+0000")
+        with self.assertNumQueries(0):
+            self.assertEqual(Reservation.is_period_valid(self.car, "2021-01-12T00:00:00+0000",
+                                                         "2021-01-22T00:00:00+0000"), False)
+
+    def test_reservation_to_miss(self):
+        self.assertEqual(Reservation.is_period_valid(self.car, "2021-01-12T00:00:00+0000", "2021-01-22T00:00:00+0000",
+                                                     self.reservation), True)
+
+    def test_invalidation(self):
+        self.assertEqual(Reservation.is_period_valid(self.car, "2021-01-12T00:00:00+0000",
+                                                     "2021-01-22T00:00:00+0000"), False)
+        self.reservation.delete()
+        self.assertEqual(Reservation.is_period_valid(self.car, "2021-01-12T00:00:00+0000",
+                                                     "2021-01-22T00:00:00+0000"), True)
+
+    def test_periods_changed_while_loading_are_not_kept(self):
+        load = reservation_index._load
+
+        def load_while_reservations_change(car_id):
+            entry = load(car_id)
+            reservation_index.invalidate(car_id)
+            return entry
+
+        period = (datetime(2021, 1, 12, tzinfo=timezone.utc), datetime(2021, 1, 22, tzinfo=timezone.utc))
+        with mock.patch.object(reservation_index, '_load', side_effect=load_while_reservations_change):
+            self.assertTrue(reservation_index.collides(self.car.pk, *period))
+        with self.assertNumQueries(1):
+            self.assertTrue(reservation_index.collides(self.car.pk, *period))
+
+
+class ReservationIndexCommitTest(TransactionTestCase):
+
+    def setUp(self):
+        reservation_index.invalidate()
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+
+    def test_periods_loaded_before_commit(self):
+        period = (datetime(2021, 1, 12, tzinfo=timezone.utc), datetime(2021, 1, 22, tzinfo=timezone.utc))
+
+        def collides():
+            try:
+                return reservation_index.collides(self.car.pk, *period)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(1) as executor:
+            with transaction.atomic():
+                Reservation.objects.create(booking_person="Marcin", date_from="2021-01-10T03:00:00Z",
+                                           date_to="2021-01-20T00:00:00Z", booked_car=self.car)
+                # Another request reads periods without the reservation which isn't committed yet
+                self.assertFalse(executor.submit(collides).result())
+            self.assertTrue(reservation_index.collides(self.car.pk, *period))
+
+
+@override_settings(ROOT_URLCONF='Ermlab.asgi_urls')
+class AsyncViewsTest(TransactionTestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+
+    async def test_get_cars(self):
+        response = await AsyncClient().get("/api/cars")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['brand'], "Opel")
+
+    async def test_views_run_in_dedicated_pool(self):
+        class ThreadView(APIView):
+            def get(self, request):
+                return Response({'thread': threading.current_thread().name})
+
+        response = await async_views.async_view(ThreadView)(RequestFactory().get('/api/thread'))
+        self.assertTrue(response.data['thread'].startswith('async-view'))
+
+    async def test_post_reservation(self):
+        client = AsyncClient()
+        data = {
+            'booking_person': "Ewelina",
+            'date_from': "2021-01-21T03:00:00Z",
+            'date_to': "2021-01-23T00:00:00Z"
+        }
+        url = f"/api/car/{self.car.pk}/reservations"
+        response = await client.post(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = await client.post(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = await client.get(url)
+        self.assertEqual(response.json()['results'][0]['booking_person'], "Ewelina")
+
+    async def test_metrics(self):
+        name = 'api_request_db_queries_sum{route="api/car/<int:pk>",method="GET"}'
+        queries = metrics.request_queries.values[(('route', 'api/car/<int:pk>'), ('method', 'GET'))][2]
+        await AsyncClient().get(f"/api/car/{self.car.pk}")
+        self.assertIn(f"{name} {queries + 1}", metrics.expose())
+
+    async def test_metrics_middleware_is_async(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = metrics.MetricsMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get('/api/cars'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ChangeStreamTest(TransactionTestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+        self.first = Change.objects.get().id
+
+    async def test_change_stream(self):
+        messages = []
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            if message.get('more_body'):
+                disconnect.set()
+
+        scope = {'type': 'http', 'path': '/api/changes/stream', 'query_string': f'since={self.first - 1}'.encode(),
+                 'headers': []}
+        await asyncio.wait_for(change_stream(scope, receive, send), 5)
+
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), messages[0]['headers'])
+        event = messages[1]['body'].decode()
+        self.assertTrue(event.startswith(f"id: {self.first}\nevent: change\ndata: "))
+        self.assertEqual(json.loads(event.split('data: ')[1])['payload']['brand'], "Opel")
+
+
+class BenchmarkTest(TransactionTestCase):
+
+    def setUp(self):
+        Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                           date_of_next_technical_examination="2021-03-19")
+
+    def test_benchmark(self):
+        output = StringIO()
+        changes = Change.objects.count()
+        call_command('benchmark', cars=3, reservations=2, repeat=2, requests=8, concurrency=2, stdout=output)
+        results = json.loads(output.getvalue())
+        self.assertEqual(results['endpoints']['GET /api/cars']['status'], status.HTTP_200_OK)
+        self.assertEqual(results['load']['requests'], 8)
+        self.assertEqual(results['load']['errors'], 0)
+        self.assertEqual(Car.objects.count(), 1)
+        self.assertEqual(Change.objects.count(), changes)
+
+    def test_benchmark_asgi(self):
+        output = StringIO()
+        call_command('benchmark_asgi', cars=3, reservations=2, requests=12, concurrency=4, use_existing_database=True,
+                     stdout=output)
+        results = json.loads(output.getvalue())
+        self.assertEqual(set(results), {'wsgi', 'asgi_sync_views', 'asgi_async_views'})
+        self.assertEqual(results['asgi_async_views']['requests'], 12)
+        self.assertEqual(Car.objects.count(), 1)
+
+    def test_benchmark_startup(self):
+        output = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('benchmark_startup', runs=1, budget_ms=0.001, stdout=output)
+        results = json.loads(output.getvalue())
+        self.assertEqual(results['Ermlab.settings']['status'], status.HTTP_200_OK)
+        self.assertEqual(results['Ermlab.settings_api']['status'], status.HTTP_200_OK)
+        self.assertLess(results['Ermlab.settings_api']['modules'], results['Ermlab.settings']['modules'])
+        self.assertGreater(results['Ermlab.settings_api']['first_response_ms']['p50'], 0)
+
+
+class DatabaseSettingsTest(TestCase):
+
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+@override_settings(REPLICA_DATABASES=['replica1', 'replica2'])
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def get_read_database(self, request):
+        def get_response(request):
+            response = HttpResponse()
+            response.database = self.router.db_for_read(Car)
+            return response
+        return ReplicaMiddleware(get_response)(request)
+
+    def test_safe_request_reads_from_replica(self):
+        response = self.get_read_database(self.factory.get('/api/cars'))
+        self.assertIn(response.database, ['replica1', 'replica2'])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.router.db_for_read(Car), 'default')
+
+    def test_request_reads_from_one_replica(self):
+        def get_response(request):
+            databases = [self.router.db_for_read(Car) for _ in range(20)]
+            # Content of streaming responses is read after the middleware returns
+            return StreamingHttpResponse(','.join([database, self.router.db_for_read(Car)])
+                                         for database in databases)
+
+        for _ in range(5):
+            response = ReplicaMiddleware(get_response)(self.factory.get('/api/reservations/export'))
+            databases = set(b','.join(response.streaming_content).decode().split(','))
+            self.assertEqual(len(databases), 1)
+            self.assertIn(databases.pop(), ['replica1', 'replica2'])
+
+    def test_sticky_read_after_write_skips_replica_cache(self):
+        class LaggingView(APIView):
+            @cached_response('cars')
+            def get(self, request):
+                # Replica hasn't received the new brand yet
+                return Response({'brand': 'Opel' if replica_database.get() else 'Skoda'})
+
+        view = ReplicaMiddleware(LaggingView.as_view())
+        write = view(self.factory.post('/api/lagging'))
+        bump_versions('cars')
+        self.assertEqual(view(self.factory.get('/api/lagging')).data, {'brand': 'Opel'})
+
+        request = self.factory.get('/api/lagging')
+        request.COOKIES[STICKY_COOKIE] = write.cookies[STICKY_COOKIE].value
+        self.assertEqual(view(request).data, {'brand': 'Skoda'})
+
+    async def test_async_request_reads_from_replica(self):
+        async def get_response(request):
+            response = HttpResponse()
+            response.database = await sync_to_async(self.router.db_for_read)(Car)
+            return response
+
+        middleware = ReplicaMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = await middleware(self.factory.get('/api/cars'))
+        self.assertIn(response.database, ['replica1', 'replica2'])
+        response = await middleware(self.factory.post('/api/cars'))
+        self.assertEqual(response.database, 'default')
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+    def test_write_request_uses_primary_and_sticks(self):
+        response = self.get_read_database(self.factory.post('/api/car/1/reservations'))
+        self.assertEqual(response.database, 'default')
+        self.assertEqual(self.router.db_for_write(Reservation), 'default')
+
+        request = self.factory.get('/api/car/1/reservations')
+        request.COOKIES[STICKY_COOKIE] = response.cookies[STICKY_COOKIE].value
+        self.assertEqual(self.get_read_database(request).database, 'default')
+
+        request = self.factory.get('/api/car/1/reservations')
+        request.COOKIES[STICKY_COOKIE] = '0'
+        self.assertIn(self.get_read_database(request).database, ['replica1', 'replica2'])
+
+    def test_migrations_only_on_primary(self):
+        self.assertTrue(self.router.allow_migrate('default', 'API'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'API'))
+
+
+class ConcurrentReservationTest(TransactionTestCase):
+
+    def setUp(self):
+        self.car = Car.objects.create(brand='Opel', model="Astra", registration_number="NO9580",
+                                      date_of_next_technical_examination="2021-03-19")
+
+    def book(self, date_from, date_to):
+        """
+        Books the car from a new thread. Test database is a file in WAL mode, concurrent bookings wait for
+        the write lock of each other, so any error is unexpected and raised to the test
+        :return: Returns status code of the response
+        """
+
+        client = APIClient()
+        data = {
+            'booking_person': "Ewelina",
+            'date_from': date_from.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'date_to': date_to.strftime('%Y-%m-%dT%H:%M:%S%z')
+        }
+        try:
+            return client.post(f"/api/car/{self.car.pk}/reservations", data).status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_identical_reservations(self):
+        period = (datetime(2021, 1, 10, tzinfo=timezone.utc), datetime(2021, 1, 12, tzinfo=timezone.utc))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            statuses = list(executor.map(lambda _: self.book(*period), range(2)))
+        self.assertEqual(sorted(statuses), [status.HTTP_201_CREATED, status.HTTP_405_METHOD_NOT_ALLOWED])
+        self.assertEqual(Reservation.objects.filter(booked_car=self.car).count(), 1)
+
+    def test_concurrent_overlapping_reservations(self):
+        """
+        tests that hundreds of concurrent overlapping bookings never create two colliding reservations
+        """
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        rand = random.Random(0)
+        periods = []
+        for _ in range(300):
+            date_from = start + timedelta(hours=rand.randrange(0, 24 * 30))
+            periods.append((date_from, date_from + timedelta(hours=rand.randrange(1, 72))))
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            statuses = list(executor.map(lambda period: self.book(*period), periods))
+
+        self.assertEqual(set(statuses), {status.HTTP_201_CREATED, status.HTTP_405_METHOD_NOT_ALLOWED})
+        reservations = list(Reservation.objects.filter(booked_car=self.car).order_by('date_from'))
+        self.assertEqual(statuses.count(status.HTTP_201_CREATED), len(reservations))
+        self.assertTrue(reservations)
+        for previous, following in zip(reservations, reservations[1:]):
+            self.assertLessEqual(previous.date_to, following.date_from)
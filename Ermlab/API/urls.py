@@ -3,7 +3,22 @@ from . import views
 
 urlpatterns = [
     path('cars', views.CarList.as_view()),
+    path('cars/bulk', views.CarBulk.as_view()),
+    path('cars/available', views.AvailableCarList.as_view()),
+    path('cars/timeline', views.TimelineList.as_view()),
+    path('cars/examinations', views.ExaminationBulk.as_view()),
+    path('cars/examinations/conflicts', views.ExaminationConflictList.as_view()),
+    path('reservations', views.AllReservationList.as_view()),
+    path('reservations/bulk', views.ReservationBulk.as_view()),
+    path('reservations/export', views.ReservationExport.as_view()),
+    path('analytics/utilization', views.Utilization.as_view()),
+    path('changes', views.ChangeList.as_view()),
+    path('availability/check', views.AvailabilityCheck.as_view()),
     path('car/<int:pk>', views.CarDetail.as_view()),
     path('car/<int:pk>/reservations', views.ReservationList.as_view()),
+    path('car/<int:pk>/timeline', views.CarTimeline.as_view()),
+    path('car/<int:pk>/reservations/bulk', views.CarReservationBulk.as_view()),
     path('car/<int:pk>/reservations/<int:pk2>', views.ReservationDetails.as_view()),
+    path('car/<int:pk>/recurring-reservations', views.RecurringReservationList.as_view()),
+    path('car/<int:pk>/recurring-reservations/<int:pk2>', views.RecurringReservationDetails.as_view()),
 ]
@@ -1,22 +1,151 @@
-from .models import Car, Reservation
+from .models import Car, Reservation, RecurringReservation, Change, BATCH_SIZE, MAX_OCCURRENCES, create_all
 from .serializers import CarSerializer, ReservationSerializer, MiniReservationSerializer, \
-    ReservationWithDetailsSerializer
+    ReservationWithDetailsSerializer, BulkCarSerializer, RecurringReservationSerializer, has_period_error
+from .pagination import IdCursorPagination
+from .interval_index import reservation_index
+from .cache import cached_response, bump_versions, idempotent
+from .fast_serializers import format_datetime
+from . import fast_serializers
+from .metrics import track_serialization
+from .dates import parse_iso_datetime
+from . import analytics
+from . import changes
+from . import availability
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from django.utils import timezone
 from django.db.models.deletion import ProtectedError
+from django.http import StreamingHttpResponse
+from itertools import chain
+import json
+import csv
+
+PERIOD_ERROR = "Dates should be given in ISO 8601 format"
+
+
+def get_period(request):
+    """
+    Reads period given by `from` and `to` query parameters, dates without offset are in TIME_ZONE
+    :return: Returns tuple of aware datetimes, None if parameter is missing
+    :raises ValueError: if date has wrong format
+    """
+
+    period = []
+    for param in ('from', 'to'):
+        if param in request.query_params:
+            date = parse_iso_datetime(request.query_params[param])
+            if date is None:
+                raise ValueError(f"Wrong date in `{param}` parameter")
+            period.append(date if timezone.is_aware(date) else timezone.make_aware(date))
+        else:
+            period.append(None)
+    return tuple(period)
+
+
+def is_archive_included(request):
+    """
+    :return: Returns True if archived reservations are requested by `include_archived` query parameter
+    """
+
+    return request.query_params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def get_error_response(serializer):
+    """
+    :param serializer: reservation serializer which failed validation
+    :return: Returns response with 405 if period of reservation was rejected, with 400 for other errors
+    """
+
+    if has_period_error(serializer.errors):
+        return Response(Reservation.get_reason_of_error(), status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def get_paginated_response(view, request, queryset, serializer_class):
+    """
+    Serializes one page of queryset, fields may be limited with `fields` query parameter.
+    Rows are built by fast serializer if FAST_SERIALIZATION_ENABLED is set and there is one for serializer_class
+    """
+
+    paginator = IdCursorPagination()
+    fields = request.query_params.get('fields')
+    if fast_serializers.is_enabled() and serializer_class in fast_serializers.FAST_SERIALIZERS:
+        serializer = fast_serializers.FAST_SERIALIZERS[serializer_class](fields=fields)
+        page = paginator.paginate_queryset(serializer.get_queryset(queryset), request, view=view)
+        with track_serialization():
+            data = serializer.to_representation(page)
+        return paginator.get_paginated_response(data)
+
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    with track_serialization():
+        data = serializer_class(page, many=True, fields=fields).data
+    return paginator.get_paginated_response(data)
 
 
 class CarList(APIView):
     """
-    List all cars instances
+    List all cars instances, page by page. Cars may be filtered by brand
     """
 
+    @cached_response('cars')
     def get(self, request, format=None):
         cars = Car.objects.all()
-        serializer = CarSerializer(cars, many=True)
-        return Response(serializer.data)
+        if 'brand' in request.query_params:
+            cars = cars.filter(brand=request.query_params['brand'])
+
+        return get_paginated_response(self, request, cars, CarSerializer)
+
+
+class AvailableCarList(APIView):
+    """
+    List all cars which can be booked in period given by `from` and `to`, page by page
+    """
+
+    def get(self, request):
+        try:
+            period_from, period_to = get_period(request)
+        except ValueError:
+            return Response(PERIOD_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        if period_from is None or period_to is None:
+            return Response("Both `from` and `to` are required", status=status.HTTP_400_BAD_REQUEST)
+        if period_from > period_to:
+            return Response("Period ends earlier than starts!", status=status.HTTP_400_BAD_REQUEST)
+
+        return get_paginated_response(self, request, Car.get_available(period_from, period_to), CarSerializer)
+
+
+class AvailabilityCheck(APIView):
+    """
+    Checks if every of given cars can be booked in every of given windows. Expects `cars` with list of ids
+    and `windows` with list of periods with `date_from` and `date_to`. Returns matrix with row for every car
+    and column for every window
+    """
+
+    def post(self, request):
+        car_ids = request.data.get('cars') if isinstance(request.data, dict) else None
+        windows_data = request.data.get('windows') if isinstance(request.data, dict) else None
+        if not isinstance(car_ids, list) or not all(isinstance(car_id, int) for car_id in car_ids) or \
+                not isinstance(windows_data, list):
+            return Response("`cars` with list of ids and `windows` with list of periods are expected",
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(car_ids) > availability.MAX_CARS or len(windows_data) > availability.MAX_WINDOWS:
+            return Response(f"At most {availability.MAX_CARS} cars and {availability.MAX_WINDOWS} windows "
+                            f"may be checked at once", status=status.HTTP_400_BAD_REQUEST)
+
+        windows = []
+        for window in windows_data:
+            dates = [parse_iso_datetime(window.get(field)) if isinstance(window, dict) and
+                     isinstance(window.get(field), str) else None for field in ('date_from', 'date_to')]
+            if None in dates:
+                return Response(PERIOD_ERROR, status=status.HTTP_400_BAD_REQUEST)
+            windows.append(tuple(date if timezone.is_aware(date) else timezone.make_aware(date) for date in dates))
+
+        matrix, not_found = availability.get_matrix(car_ids, windows)
+        return Response({'cars': car_ids, 'available': matrix, 'not_found': not_found})
 
 
 class CarDetail(APIView):
@@ -24,11 +153,13 @@ class CarDetail(APIView):
     Create, retrieve, update or delete a car instance.
     """
 
+    @cached_response('car:{pk}')
     def get(self, request, pk):
         cars = get_object_or_404(Car, pk=pk)
         serializer = CarSerializer(cars)
         return Response(serializer.data)
 
+    @idempotent
     def post(self, request, pk):
         serializer = CarSerializer(data=request.data)
         if serializer.is_valid():
@@ -36,6 +167,7 @@ class CarDetail(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @idempotent
     def put(self, request, pk):
         car = get_object_or_404(Car, pk=pk)
         serializer = CarSerializer(car, data=request.data)
@@ -44,6 +176,7 @@ class CarDetail(APIView):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @idempotent
     def patch(self, request, pk):
         car = get_object_or_404(Car, pk=pk)
         serializer = CarSerializer(car, data=request.data, partial=True)
@@ -62,37 +195,490 @@ class CarDetail(APIView):
                             status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+class CarBulk(APIView):
+    """
+    Creates many cars at once. Result for every car is returned in order of request
+    """
+
+    @transaction.atomic
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response("List of cars is expected", status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        serializers = []
+        for car_data in request.data:
+            serializer = BulkCarSerializer(data=car_data)
+            if serializer.is_valid():
+                results.append({'status': status.HTTP_201_CREATED})
+            else:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+            serializers.append(serializer)
+
+        # Checks uniqueness of registration numbers against database and inside the batch
+        used = Car.get_taken_registration_numbers(
+            [serializer.validated_data['registration_number'] for result, serializer in zip(results, serializers)
+             if result['status'] == status.HTTP_201_CREATED and serializer.validated_data.get('registration_number')])
+
+        cars = []
+        for result, serializer in zip(results, serializers):
+            if result['status'] != status.HTTP_201_CREATED:
+                continue
+            registration_number = serializer.validated_data.get('registration_number')
+            if registration_number in used:
+                result['status'] = status.HTTP_400_BAD_REQUEST
+                result['errors'] = {'registration_number': ["car with this registration number already exists."]}
+                continue
+            if registration_number:
+                used.add(registration_number)
+            car = Car(**serializer.validated_data)
+            cars.append((result, car))
+
+        create_all([car for _, car in cars])
+        # bulk_create doesn't send post_save signals
+        bump_versions('cars')
+        changes.record(Change.SAVE, [car for _, car in cars])
+        for result, car in cars:
+            result['data'] = CarSerializer(car).data
+
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+
+def get_active_after(request):
+    """
+    :return: Returns date given by `after` query parameter, now if it's missing or None if it's wrong
+    """
+
+    after = request.query_params.get('after')
+    return parse_iso_datetime(after) if after else timezone.now()
+
+
+class ExaminationConflictList(APIView):
+    """
+    List reservations which end after technical examination of their cars, with details of cars, page by page.
+    Only reservations ending after `after` (now by default) of cars with examination before `before` are listed.
+    Lists are cached only for given `after`, lists of now change with time
+    """
+
+    def get(self, request):
+        if 'after' in request.query_params:
+            return self.get_cached(request)
+        return self.list_conflicts(request)
+
+    @cached_response('cars', 'reservations')
+    def get_cached(self, request):
+        return self.list_conflicts(request)
+
+    def list_conflicts(self, request):
+        before = request.query_params.get('before')
+        try:
+            examination_before = parse_date(before) if before else None
+        except ValueError:
+            # Well formed date which doesn't exist, e.g. 2021-02-30
+            examination_before = None
+        active_after = get_active_after(request)
+        if active_after is None or (before and examination_before is None):
+            return Response("`after` should be date and time and `before` date in ISO 8601 format",
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        conflicts = Reservation.get_examination_conflicts(examination_before, active_after)
+        paginator = IdCursorPagination()
+        page = paginator.paginate_queryset(conflicts, request, view=self)
+        serializer = ReservationWithDetailsSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ExaminationBulk(APIView):
+    """
+    Sets dates of technical examination of many cars at once, e.g. after a service day.
+    Returns updated cars, ids of missing cars and reservations ending after `after` (now by default)
+    which collide with new dates
+    """
+
+    @transaction.atomic
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response("List of cars is expected", status=status.HTTP_400_BAD_REQUEST)
+        active_after = get_active_after(request)
+        if active_after is None:
+            return Response("`after` should be date and time in ISO 8601 format", status=status.HTTP_400_BAD_REQUEST)
+
+        dates = {}
+        for car_data in request.data:
+            car_id = car_data.get('id') if isinstance(car_data, dict) else None
+            date = car_data.get('date_of_next_technical_examination') if isinstance(car_data, dict) else None
+            try:
+                date = parse_date(date) if isinstance(date, str) else None
+            except ValueError:
+                date = None
+            if not isinstance(car_id, int) or date is None:
+                return Response("Every car should have `id` and `date_of_next_technical_examination` in ISO 8601 "
+                                "format", status=status.HTTP_400_BAD_REQUEST)
+            dates[car_id] = date
+
+        return Response(self.update_examinations(dates, active_after))
+
+    @staticmethod
+    def update_examinations(dates, active_after):
+        """
+        Updates dates of technical examination and reports reservations impacted by them.
+        Has to be called inside transaction.atomic()
+        :param dates: dict of car ids mapped to dates of next technical examination
+        :param active_after: only reservations ending after this date are reported
+        """
+
+        cars = Car.update_examinations(dates)
+        # bulk_update doesn't send post_save signals
+        bump_versions('cars', 'reservations', *(scope for car in cars
+                                                 for scope in (f'car:{car.pk}', f'reservations:{car.pk}')))
+        changes.record(Change.SAVE, cars)
+
+        updated = sorted(car.pk for car in cars)
+        impacted = []
+        for start in range(0, len(updated), BATCH_SIZE):
+            impacted.extend(Reservation.get_examination_conflicts(
+                active_after=active_after, car_ids=updated[start:start + BATCH_SIZE]).order_by('id'))
+        return {
+            'updated': updated,
+            'not_found': sorted(set(dates) - set(updated)),
+            'impacted_reservations': ReservationWithDetailsSerializer(impacted, many=True).data,
+        }
+
+
+class ReservationBulk(APIView):
+    """
+    Creates many reservations of any cars at once, every reservation has to contain booked_car.
+    Result for every reservation is returned in order of request
+    """
+
+    @transaction.atomic
+    def post(self, request):
+        if not isinstance(request.data, list):
+            return Response("List of reservations is expected", status=status.HTTP_400_BAD_REQUEST)
+        return self.create_reservations(request.data)
+
+    @staticmethod
+    def create_reservations(reservations_data, pk=None):
+        """
+        Validates whole batch and saves valid reservations. Has to be called inside transaction.atomic()
+        :param reservations_data: list of reservations sent in request
+        :param pk: if given, all reservations are booked for this car
+        """
+
+        results = []
+        serializers = []
+        for reservation_data in reservations_data:
+            serializer = MiniReservationSerializer(data=reservation_data)
+            car_id = pk
+            if car_id is None and isinstance(reservation_data, dict):
+                car_id = reservation_data.get('booked_car')
+            if serializer.is_valid() and isinstance(car_id, int):
+                results.append({'status': status.HTTP_201_CREATED})
+            elif serializer.is_valid():
+                results.append({'status': status.HTTP_400_BAD_REQUEST,
+                                'errors': {'booked_car': ["Id of the car is required."]}})
+            else:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+            serializers.append((serializer, car_id))
+
+        # Locks and fetches all booked cars with one query
+        car_ids = sorted({car_id for result, (_, car_id) in zip(results, serializers)
+                          if result['status'] == status.HTTP_201_CREATED})
+        cars = Car.lock_for_booking(*car_ids).in_bulk() if car_ids else {}
+
+        reservations = []
+        for result, (serializer, car_id) in zip(results, serializers):
+            if result['status'] != status.HTTP_201_CREATED:
+                continue
+            if car_id not in cars:
+                result['status'] = status.HTTP_404_NOT_FOUND
+                continue
+            reservation = Reservation(booked_car=cars[car_id], **serializer.validated_data)
+            reservations.append((result, reservation))
+
+        # Checks the batch against existing reservations and against itself
+        valid = Reservation.get_valid_in_batch([reservation for _, reservation in reservations])
+        reservations_to_create = []
+        for is_valid, (result, reservation) in zip(valid, reservations):
+            if is_valid:
+                reservations_to_create.append((result, reservation))
+            else:
+                result['status'] = status.HTTP_405_METHOD_NOT_ALLOWED
+                result['errors'] = Reservation.get_reason_of_error()
+
+        create_all([reservation for _, reservation in reservations_to_create])
+        # bulk_create doesn't send post_save signals
+        changes.record(Change.SAVE, [reservation for _, reservation in reservations_to_create])
+        for car_id in cars:
+            reservation_index.invalidate(car_id)
+        bump_versions('reservations', *(f'reservations:{car_id}' for car_id in cars))
+        if analytics.is_rollup_enabled():
+            periods_of_car = {}
+            for _, reservation in reservations_to_create:
+                periods_of_car.setdefault(reservation.booked_car_id, []).extend(
+                    (reservation.date_from, reservation.date_to))
+            for car_id, periods in periods_of_car.items():
+                analytics.refresh_occupancy(car_id, min(periods), max(periods))
+        for result, reservation in reservations_to_create:
+            result['data'] = ReservationSerializer(reservation).data
+
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+
+class CarReservationBulk(APIView):
+    """
+    Creates many reservations for specific car at once. Result for every reservation is returned in order of request
+    """
+
+    @transaction.atomic
+    def post(self, request, pk):
+        get_object_or_404(Car, pk=pk)
+        if not isinstance(request.data, list):
+            return Response("List of reservations is expected", status=status.HTTP_400_BAD_REQUEST)
+        return ReservationBulk.create_reservations(request.data, pk)
+
+
+class AllReservationList(APIView):
+    """
+    List reservations of all cars with details of booked cars, page by page.
+    Archived reservations are listed too if `include_archived` is set
+    """
+
+    @cached_response('reservations')
+    def get(self, request):
+        paginator = IdCursorPagination()
+        reservations = Reservation.get_with_details(is_archive_included(request))
+        page = paginator.paginate_queryset(reservations, request, view=self)
+        serializer = ReservationWithDetailsSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class Utilization(APIView):
+    """
+    Shows booked and available hours of every car or brand in period given by `from` and `to`.
+    Cars are grouped by `group_by` (car or brand), period may be split by `bucket` (day or week)
+    """
+
+    @cached_response('cars', 'reservations')
+    def get(self, request):
+        try:
+            period_from, period_to = get_period(request)
+        except ValueError:
+            return Response(PERIOD_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        if period_from is None or period_to is None:
+            return Response("Both `from` and `to` are required", status=status.HTTP_400_BAD_REQUEST)
+        if period_from >= period_to:
+            return Response("Period ends earlier than starts!", status=status.HTTP_400_BAD_REQUEST)
+
+        group_by = request.query_params.get('group_by', 'car')
+        bucket = request.query_params.get('bucket')
+        if group_by not in analytics.GROUPS:
+            return Response(f"`group_by` should be one of: {', '.join(analytics.GROUPS)}",
+                            status=status.HTTP_400_BAD_REQUEST)
+        if bucket is not None and bucket not in analytics.BUCKETS:
+            return Response(f"`bucket` should be one of: {', '.join(analytics.BUCKETS)}",
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            results = analytics.get_utilization(period_from, period_to, group_by, bucket)
+        except ValueError as error:
+            return Response(str(error), status=status.HTTP_400_BAD_REQUEST)
+        return Response({'from': format_datetime(period_from), 'to': format_datetime(period_to),
+                         'group_by': group_by, 'bucket': bucket, 'results': results})
+
+
+def get_timeline_data(car, timeline):
+    busy, free = timeline
+    return {
+        'car': car.pk,
+        'busy': [{'date_from': format_datetime(date_from), 'date_to': format_datetime(date_to)}
+                 for date_from, date_to in busy],
+        'free': [{'date_from': format_datetime(date_from), 'date_to': format_datetime(date_to)}
+                 for date_from, date_to in free],
+    }
+
+
+def get_timeline_period(request):
+    """
+    Reads period of timeline given by `from` and `to` query parameters
+    :raises ValueError: with message for response if period is missing or wrong
+    """
+
+    try:
+        period_from, period_to = get_period(request)
+    except ValueError:
+        raise ValueError(PERIOD_ERROR)
+    if period_from is None or period_to is None:
+        raise ValueError("Both `from` and `to` are required")
+    if period_from > period_to:
+        raise ValueError("Period ends earlier than starts!")
+    return period_from, period_to
+
+
+class CarTimeline(APIView):
+    """
+    Shows merged busy periods of specific car and free gaps between them in period given by `from` and `to`
+    """
+
+    @cached_response('car:{pk}', 'reservations:{pk}')
+    def get(self, request, pk):
+        car = get_object_or_404(Car, pk=pk)
+        try:
+            period_from, period_to = get_timeline_period(request)
+        except ValueError as error:
+            return Response(str(error), status=status.HTTP_400_BAD_REQUEST)
+
+        timelines = Reservation.get_timelines([car], period_from, period_to)
+        return Response(get_timeline_data(car, timelines[car.pk]))
+
+
+class TimelineList(APIView):
+    """
+    Shows timelines of many cars in period given by `from` and `to`, page by page.
+    Cars may be chosen by comma separated `ids` or filtered by brand
+    """
+
+    @cached_response('cars', 'reservations')
+    def get(self, request):
+        try:
+            period_from, period_to = get_timeline_period(request)
+        except ValueError as error:
+            return Response(str(error), status=status.HTTP_400_BAD_REQUEST)
+
+        cars = Car.objects.all()
+        if 'ids' in request.query_params:
+            try:
+                cars = cars.filter(pk__in=[int(pk) for pk in request.query_params['ids'].split(',')])
+            except ValueError:
+                return Response("`ids` should be comma separated numbers", status=status.HTTP_400_BAD_REQUEST)
+        if 'brand' in request.query_params:
+            cars = cars.filter(brand=request.query_params['brand'])
+
+        paginator = IdCursorPagination()
+        page = paginator.paginate_queryset(cars, request, view=self)
+        timelines = Reservation.get_timelines(page, period_from, period_to)
+        with track_serialization():
+            data = [get_timeline_data(car, timelines[car.pk]) for car in page]
+        return paginator.get_paginated_response(data)
+
+
+class ChangeList(APIView):
+    """
+    Lists changes of cars and reservations made after change given by `since`, in order of their sequence.
+    Clients keep `last` of response and send it as `since` of the next request. Responses aren't cached,
+    changes held back by a gap in sequence are released with time, not by a write
+    """
+
+    def get(self, request):
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', IdCursorPagination.page_size))
+            limit = max(1, min(limit, IdCursorPagination.max_page_size))
+        except ValueError:
+            return Response("`since` and `limit` should be numbers", status=status.HTTP_400_BAD_REQUEST)
+
+        entries = Change.get_since(since, limit)
+        for entry in entries:
+            entry['created_at'] = format_datetime(entry['created_at'])
+        return Response({'results': entries, 'last': entries[-1]['id'] if entries else since,
+                         'more': len(entries) == limit})
+
+
+class Echo:
+    """
+    Pseudo buffer for csv.writer, which returns written line instead of storing it
+    """
+
+    def write(self, value):
+        return value
+
+
+class ReservationExport(APIView):
+    """
+    Streams all reservations overlapping period given by optional `from` and `to`.
+    Rows are written as NDJSON or as CSV when `output=csv` is given, without building whole response in memory
+    """
+
+    fields = ('id', 'booking_person', 'date_from', 'date_to', 'booked_car')
+
+    def get(self, request):
+        try:
+            period_from, period_to = get_period(request)
+        except ValueError:
+            return Response(PERIOD_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        output = request.query_params.get('output', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            return Response("Output should be ndjson or csv", status=status.HTTP_400_BAD_REQUEST)
+
+        reservations = Reservation.objects.order_by('id')
+        if period_from is not None:
+            reservations = reservations.filter(date_to__gt=period_from)
+        if period_to is not None:
+            reservations = reservations.filter(date_from__lt=period_to)
+        rows = self.get_rows(reservations.values_list(*self.fields).iterator(chunk_size=2000))
+
+        if output == 'csv':
+            writer = csv.writer(Echo())
+            lines = (writer.writerow(row) for row in chain([self.fields], rows))
+            response = StreamingHttpResponse(lines, content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="reservations.csv"'
+            return response
+
+        lines = (json.dumps(dict(zip(self.fields, row))) + '\n' for row in rows)
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+    def get_rows(self, rows):
+        """
+        Formats dates of rows the same way as serializers
+        """
+
+        for reservation_id, booking_person, date_from, date_to, booked_car in rows:
+            yield reservation_id, booking_person, format_datetime(date_from), format_datetime(date_to), booked_car
+
+
 class ReservationList(APIView):
     """
-    List all reservations for specific car or creates new reservation for specific car
+    List all reservations for specific car or creates new reservation for specific car.
+    Listed reservations may be limited to ones overlapping period given by `from` and `to`,
+    archived reservations are listed too if `include_archived` is set
     """
 
+    @cached_response('reservations:{pk}')
     def get(self, request, pk):
         reserved_car = get_object_or_404(Car, pk=pk)
-        reservations = Reservation.get_reservations(reserved_car)
-        serializer = MiniReservationSerializer(reservations, many=True)
-        return Response(serializer.data)
+        reservations = Reservation.get_all(is_archive_included(request)).filter(booked_car=reserved_car)
+
+        # Filters reservations which overlap requested period
+        try:
+            period_from, period_to = get_period(request)
+        except ValueError:
+            return Response(PERIOD_ERROR, status=status.HTTP_400_BAD_REQUEST)
+        if period_from is not None:
+            reservations = reservations.filter(date_to__gt=period_from)
+        if period_to is not None:
+            reservations = reservations.filter(date_from__lt=period_to)
+
+        return get_paginated_response(self, request, reservations, MiniReservationSerializer)
 
+    @idempotent
+    @transaction.atomic
     def post(self, request, pk):
-        car = get_object_or_404(Car, pk=pk)
+        car = get_object_or_404(Car.lock_for_booking(pk), pk=pk)
 
         # Prepares data for serializer
         reservation_to_create = {
-            'booking_person': request.data['booking_person'],
-            'date_from': request.data['date_from'],
-            'date_to': request.data['date_to'],
+            'booking_person': request.data.get('booking_person'),
+            'date_from': request.data.get('date_from'),
+            'date_to': request.data.get('date_to'),
             'booked_car': pk
         }
 
-        # Checks if date of new reservations doesn't collide with others and saves in DB if it's ok
-        if Reservation.is_period_valid(car, request.data['date_from'], request.data['date_to']):
-            serializer = ReservationSerializer(data=reservation_to_create, many=False)
-            if serializer.is_valid():
-                serializer.save()
-                return Response(reservation_to_create, status=status.HTTP_201_CREATED)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response(Reservation.get_reason_of_error(), status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        # Serializer checks if date of new reservations doesn't collide with others and saves in DB if it's ok
+        serializer = MiniReservationSerializer(data=reservation_to_create, context={'car': car})
+        if serializer.is_valid():
+            serializer.save(booked_car=car)
+            return Response(reservation_to_create, status=status.HTTP_201_CREATED)
+        return get_error_response(serializer)
 
 
 class ReservationDetails(APIView):
@@ -100,41 +686,114 @@ class ReservationDetails(APIView):
     shows details of specific reservation, edits or deletes it
     """
 
+    @cached_response('reservations:{pk}')
     def get(self, request, pk, pk2):
-        reservation = get_object_or_404(Reservation, pk=pk2)
+        reservation = get_object_or_404(Reservation.get_with_details(), pk=pk2, booked_car=pk)
         serializer = ReservationWithDetailsSerializer(reservation, many=False)
         return Response(serializer.data)
 
+    @idempotent
+    @transaction.atomic
     def put(self, request, pk, pk2):
-        car = get_object_or_404(Car, pk=pk)
-        reservation = get_object_or_404(Reservation, pk=pk2)
-        serializer = MiniReservationSerializer(reservation, data=request.data)
+        # Reservation has to belong to the locked car, so it's checked against reservations of the same car
+        car = get_object_or_404(Car.lock_for_booking(pk), pk=pk)
+        reservation = get_object_or_404(Reservation, pk=pk2, booked_car=car)
+        serializer = MiniReservationSerializer(reservation, data=request.data, context={'car': car})
 
-        if Reservation.is_period_valid(car, request.data['date_from'], request.data['date_to']):
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response(Reservation.get_reason_of_error(), status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data)
+        return get_error_response(serializer)
 
+    @idempotent
+    @transaction.atomic
     def patch(self, request, pk, pk2):
-        car = get_object_or_404(Car, pk=pk)
-        reservation = get_object_or_404(Reservation, pk=pk2)
-        serializer = MiniReservationSerializer(reservation, data=request.data, partial=True)
+        car = get_object_or_404(Car.lock_for_booking(pk), pk=pk)
+        reservation = get_object_or_404(Reservation, pk=pk2, booked_car=car)
+        serializer = MiniReservationSerializer(reservation, data=request.data, partial=True, context={'car': car})
 
-        new_from = request.data['date_from'] if 'date_from' in list(request.data.keys()) else reservation.date_from
-        new_to = request.data['date_to'] if 'date_to' in list(request.data.keys()) else reservation.date_to
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data)
+        return get_error_response(serializer)
 
-        if Reservation.is_period_valid(car, new_from, new_to, reservation):
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
+    def delete(self, request, pk, pk2):
+        reservation = get_object_or_404(Reservation, pk=pk2, booked_car=pk)
+        reservation.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RecurringReservationList(APIView):
+    """
+    List recurring reservations of specific car or creates new one. All occurrences are validated at once
+    and saved as reservations of the car, so they are respected by every other endpoint
+    """
+
+    def get(self, request, pk):
+        car = get_object_or_404(Car, pk=pk)
+        recurring_reservations = RecurringReservation.objects.filter(booked_car=car)
+        return get_paginated_response(self, request, recurring_reservations, RecurringReservationSerializer)
+
+    @transaction.atomic
+    def post(self, request, pk):
+        car = get_object_or_404(Car.lock_for_booking(pk), pk=pk)
+        serializer = RecurringReservationSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response(Reservation.get_reason_of_error(), status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        recurring_reservation = RecurringReservation(booked_car=car, **serializer.validated_data)
+        # One more occurrence is expanded to tell rules with exactly MAX_OCCURRENCES from longer ones
+        occurrences = list(recurring_reservation.get_occurrences(limit=MAX_OCCURRENCES + 1))
+        if not occurrences:
+            return Response("Rule doesn't produce any occurrence", status=status.HTTP_400_BAD_REQUEST)
+        if len(occurrences) > MAX_OCCURRENCES:
+            return Response(f"Rule can't produce more than {MAX_OCCURRENCES} occurrences",
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        colliding = Reservation.get_colliding_periods(car, occurrences)
+        if colliding:
+            colliding = [{'date_from': format_datetime(date_from), 'date_to': format_datetime(date_to)}
+                         for date_from, date_to in colliding]
+            return Response({'errors': Reservation.get_reason_of_error(), 'colliding': colliding},
+                            status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+        recurring_reservation.save()
+        reservations = [Reservation(booking_person=recurring_reservation.booking_person, date_from=date_from,
+                                    date_to=date_to, booked_car=car, recurring_reservation=recurring_reservation)
+                        for date_from, date_to in occurrences]
+        create_all(reservations)
+        # bulk_create doesn't send post_save signals
+        changes.record(Change.SAVE, reservations)
+        reservation_index.invalidate(car.pk)
+        bump_versions('reservations', f'reservations:{car.pk}')
+        if analytics.is_rollup_enabled():
+            analytics.refresh_occupancy(car.pk, occurrences[0][0], occurrences[-1][1])
+
+        data = RecurringReservationSerializer(recurring_reservation).data
+        data['occurrences'] = len(occurrences)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class RecurringReservationDetails(APIView):
+    """
+    Shows recurring reservation with its occurrences or deletes it together with the occurrences.
+    Occurrences are expanded from the rule, they may be limited to ones overlapping `from` and `to`
+    """
+
+    def get(self, request, pk, pk2):
+        recurring_reservation = get_object_or_404(RecurringReservation, pk=pk2, booked_car=pk)
+        try:
+            period_from, period_to = get_period(request)
+        except ValueError:
+            return Response(PERIOD_ERROR, status=status.HTTP_400_BAD_REQUEST)
+
+        data = RecurringReservationSerializer(recurring_reservation).data
+        data['occurrences'] = [{'date_from': format_datetime(date_from), 'date_to': format_datetime(date_to)}
+                               for date_from, date_to in recurring_reservation.get_occurrences(period_from,
+                                                                                               period_to)]
+        return Response(data)
 
     def delete(self, request, pk, pk2):
-        reservation = get_object_or_404(Reservation, pk=pk2)
-        reservation.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        recurring_reservation = get_object_or_404(RecurringReservation, pk=pk2, booked_car=pk)
+        recurring_reservation.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ermlab.settings')
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'Ermlab.asgi_urls')
 
 application = get_asgi_application()
+
+# Imported after Django is set up by get_asgi_application
+from API.streams import with_streams  # noqa: E402
+
+# Server-Sent Events of changes are streamed without blocking the event loop
+application = with_streams(application)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,11 +38,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'API',
+    'API.apps.ApiConfig',
     'rest_framework'
 ]
 
 MIDDLEWARE = [
+    'API.metrics.MetricsMiddleware',
+    'API.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,7 +54,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'Ermlab.urls'
+# ASGI application serves cars and reservations with async views from Ermlab.asgi_urls
+ROOT_URLCONF = os.environ.get('DJANGO_ROOT_URLCONF', 'Ermlab.urls')
+
+# Async views run sync views in pool of this many threads, it's the ceiling of requests handled at once by
+# one ASGI process. Every thread keeps own database connection, so it has to fit into limit of connections
+ASYNC_VIEW_THREADS = int(os.environ.get('ASYNC_VIEW_THREADS', 20))
 
 TEMPLATES = [
     {
@@ -76,13 +84,102 @@ WSGI_APPLICATION = 'Ermlab.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
+# Database is configured by environment variables. SQLite is used by default, PostgreSQL after setting
+# DATABASE_ENGINE=postgresql (requires psycopg2 from requirements-optional.txt). Connections are reused for
+# DATABASE_CONN_MAX_AGE seconds, put pgbouncer in front of PostgreSQL when connections of many workers have to be
+# pooled. `manage.py test` uses Ermlab.settings_test, which doesn't reuse connections
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 60))
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'ermlab'),
+            'USER': os.environ.get('DATABASE_USER', 'ermlab'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Seconds which writer waits for lock of another one
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+            },
+            # File based test database, so concurrent tests lock it like the real one
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+# Reads of safe requests go to replicas listed in DATABASE_REPLICAS, comma separated hosts of PostgreSQL
+# or files of SQLite. Client reads from the primary for REPLICA_STICKY_SECONDS after its own write.
+# Locally a copy of db.sqlite3 may stand in for replica, e.g. DATABASE_REPLICAS=replica.sqlite3
+
+DATABASE_REPLICAS = [replica for replica in os.environ.get('DATABASE_REPLICAS', '').split(',') if replica]
+
+for number, replica in enumerate(DATABASE_REPLICAS, 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST' if DATABASE_ENGINE == 'postgresql' else 'NAME': replica,
+        # Tests read replicas through connection of the test database
+        'TEST': {'MIRROR': 'default'},
+    }
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+
+REPLICA_STICKY_SECONDS = 10
+
+DATABASE_ROUTERS = ['API.routers.ReplicaRouter']
+
+# Pragmas executed on every new SQLite connection. In WAL mode readers don't block writer and writer
+# doesn't block readers, with synchronous=NORMAL commits don't wait for fsync of the log
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Responses of read endpoints are cached until cars or reservations change.
+# Local memory cache is kept by every process, so changes made by one worker are seen by others
+# after RESPONSE_CACHE_TIMEOUT. Cache shared by all workers is used after setting REDIS_URL
+# (requires django-redis from requirements-optional.txt)
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Responses to writes with Idempotency-Key header are replayed for retries during this many seconds
+
+IDEMPOTENCY_KEY_TIMEOUT = 24 * 60 * 60
+
+# Retries are rejected with 409 while the first request is handled, but not longer than this many seconds.
+# It should be longer than timeout of requests, e.g. of gunicorn workers
+
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -123,3 +220,66 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+# In-process index of reservation periods used to reject colliding bookings without database query
+# Every process keeps own copy, so entries expire after RESERVATION_INDEX_TTL seconds
+
+RESERVATION_INDEX_ENABLED = False
+
+RESERVATION_INDEX_TTL = 60
+
+RESERVATION_INDEX_MAX_CARS = 10000
+
+
+# Booked time of every car per day is kept in rollup table, so utilization reports don't scan reservations.
+# Utilization counts archived reservations too. Run `manage.py rebuild_occupancy` after enabling it on existing data
+
+OCCUPANCY_ROLLUP_ENABLED = False
+
+
+# Reservations which ended earlier are moved to archive by `manage.py archive_reservations`,
+# lists include them only with `include_archived` query parameter
+
+ARCHIVE_AFTER_DAYS = 365
+
+
+# Every change of cars and reservations is appended to change log served by /api/changes.
+# ASGI application streams it as Server-Sent Events on /api/changes/stream, polling the log every
+# CHANGE_STREAM_POLL_INTERVAL seconds. Changes after a gap in sequence are served after CHANGE_LOG_LAG seconds,
+# when transaction which left the gap has committed or rolled back. Changes older than CHANGE_LOG_RETENTION_DAYS
+# are deleted by `manage.py prune_changes`, clients which are behind longer have to read data again
+
+CHANGE_LOG_ENABLED = True
+
+CHANGE_LOG_LAG = 5
+
+CHANGE_LOG_RETENTION_DAYS = 30
+
+CHANGE_STREAM_ENABLED = True
+
+CHANGE_STREAM_POLL_INTERVAL = 1
+
+CHANGE_STREAM_KEEPALIVE = 15
+
+
+# Rest framework
+# https://www.django-rest-framework.org/api-guide/settings/
+# JSON is rendered by orjson if it's installed, output is the same as output of default renderer
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'API.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Lists are built from values() of querysets instead of ModelSerializers
+
+FAST_SERIALIZATION_ENABLED = False
+
+
+# Metrics of requests are exposed on /metrics. Every PROFILE_EVERY_N_REQUESTS-th request is profiled
+# with cProfile and its stats are dumped to PROFILE_DIR, 0 turns profiling off
+
+PROFILE_EVERY_N_REQUESTS = 0
+
+PROFILE_DIR = BASE_DIR / 'profiles'
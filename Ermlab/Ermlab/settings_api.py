@@ -0,0 +1,49 @@
+"""
+API-only settings profile for autoscaled deployments where start of new processes matters.
+
+It's used by setting DJANGO_SETTINGS_MODULE=Ermlab.settings_api, everything not listed here comes from
+Ermlab.settings. Compared to it, the profile:
+- installs only the API app, without admin, auth, contenttypes, sessions, messages and staticfiles,
+  so /admin/ isn't routed and their models, checks and signals aren't loaded
+- keeps only middleware which the API uses, requests aren't authenticated and request.user is None
+- has no template engine, responses are rendered only as JSON, without the browsable API
+- turns off translations, messages of errors are in English like before
+
+Time from start of a process to the first response of /api/cars and its memory are measured by
+`manage.py benchmark_startup`, with `--budget-ms` it fails when start takes longer
+"""
+
+from .settings import *  # noqa: F401, F403
+
+INSTALLED_APPS = [
+    'API.apps.ApiConfig',
+]
+
+MIDDLEWARE = [
+    'API.metrics.MetricsMiddleware',
+    'API.routers.ReplicaMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
+
+# Rest framework imports only renderers and parsers listed here, the browsable API isn't loaded
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'API.renderers.FastJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    'UNAUTHENTICATED_USER': None,
+}
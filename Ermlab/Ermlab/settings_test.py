@@ -0,0 +1,13 @@
+"""
+Settings of tests, `python manage.py test` uses them unless DJANGO_SETTINGS_MODULE or --settings is given.
+
+Everything comes from Ermlab.settings, except that database connections aren't reused. Tests open connections
+in many threads, e.g. of servers of benchmarks and async views, and they have to be closed after every request,
+so the test database can be destroyed at the end
+"""
+
+from .settings import *  # noqa: F401, F403
+from .settings import DATABASES
+
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = 0
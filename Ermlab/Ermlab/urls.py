@@ -1,8 +1,15 @@
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
+from API.metrics import metrics_view
 
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    path('metrics', metrics_view),
     path('api/', include('API.urls')),
 ]
+
+# Admin isn't installed by the API-only profile in Ermlab.settings_api
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
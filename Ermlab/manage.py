@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ermlab.settings')
+    # Tests run with their own profile, which closes database connections of their many threads
+    default_settings = 'Ermlab.settings_test' if sys.argv[1:2] == ['test'] else 'Ermlab.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default_settings)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: